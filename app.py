@@ -1,17 +1,35 @@
 
 import os
 import json
-import requests
+import base64
+import binascii
+import hashlib
+import time
 import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, make_response, Response, stream_with_context, get_template_attribute
 from datetime import timedelta
-from firebase_setup import db
-from firebase_admin import auth as admin_auth
-from google.cloud.firestore import Query
+from firebase_setup import db, ensure_firebase_app
+from cache import TTLCache, VersionStamp
+from fanout import fan_out, query_latency
+from uploads import UploadPipeline, expire_stale_uploads
+from notifications import NotificationDispatcher, TelegramSender
+from retention import run_retention
+from task_catalog import TaskCatalog
+from approvals import bulk_approve
+from settings import SettingsCache, SETTINGS_LISTENER
+from moderation import (ModerationQueue, QUEUES, MODERATION_LISTENER, MODERATION_PAGE_SIZE,
+                        MODERATION_KEEPALIVE, MODERATION_STREAM_SECONDS)
+from repositories import Repositories
+import ledger
+import counters
+import metrics
+import lazy_firestore as firestore
 
 # Load Envs
-from dotenv import load_dotenv
-load_dotenv()
+# Vercel ENV সরাসরি দেয়, .env ফাইল শুধু লোকালে লাগে
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 app = Flask(__name__)
 
@@ -20,6 +38,28 @@ app.secret_key = os.getenv("SECRET_KEY", "dev_secret")
 app.permanent_session_lifetime = timedelta(days=7)
 ADMIN_ROUTE = os.getenv("ADMIN_ROUTE", "admin")
 IMGBB_API_KEY = os.getenv("IMGBB_API_KEY")
+IMGBB_UPLOAD_URL = os.getenv("IMGBB_UPLOAD_URL", "https://api.imgbb.com/1/upload") # লোকাল ফেক হোস্টে টেস্ট করার জন্য
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", 20))
+CRON_SECRET = os.getenv("CRON_SECRET") # Vercel Cron এটি Authorization হেডারে পাঠায়
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # Prometheus স্ক্র্যাপার Bearer টোকেন দিয়ে /metrics পড়তে পারবে
+
+# Ban status cache: entries live BAN_CACHE_TTL seconds; other instances notice
+# an admin ban/unban/delete within BAN_CACHE_STALENESS seconds.
+BAN_CACHE_TTL = int(os.getenv("BAN_CACHE_TTL", 300))
+BAN_CACHE_SIZE = int(os.getenv("BAN_CACHE_SIZE", 10000))
+BAN_CACHE_STALENESS = int(os.getenv("BAN_CACHE_STALENESS", 30))
+
+# Notice feed: first page is rendered once per variant (admin/user/guest) and
+# shared; other instances pick up a new notice within NOTICE_CACHE_STALENESS seconds.
+NOTICE_PAGE_SIZE = int(os.getenv("NOTICE_PAGE_SIZE", 10))
+NOTICE_CACHE_TTL = int(os.getenv("NOTICE_CACHE_TTL", 600))
+NOTICE_CACHE_STALENESS = int(os.getenv("NOTICE_CACHE_STALENESS", 30))
+
+# Dashboard: rendered HTML per user, keyed (and ETagged) on the user document's
+# update_time, so any write to users/{uid} makes every instance re-render.
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", 300))
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", 1000))
+DEPLOY_ID = os.getenv("VERCEL_GIT_COMMIT_SHA", "") # নতুন ডিপ্লয়ে টেমপ্লেট বদলাতে পারে, তাই ETag-এ রাখা হয়
 
 # --- FIREBASE CLIENT CONFIG (Passed to Frontend) ---
 firebase_config = {
@@ -32,6 +72,234 @@ firebase_config = {
 }
 
 # --- HELPERS ---
+# --- HELPER: REQUEST METRICS (Server-Timing + Prometheus) ---
+metrics.init_app(app, db)
+
+# --- HELPER: DATA ACCESS ---
+repos = Repositories(db)
+
+# --- HELPER: BAN STATUS CACHE ---
+ban_cache = TTLCache(maxsize=BAN_CACHE_SIZE, ttl=BAN_CACHE_TTL)
+ban_version = VersionStamp(repos, 'bans', staleness=BAN_CACHE_STALENESS)
+
+def invalidate_ban_state(uid):
+    """Drop the cached ban state locally and tell other instances to do the same."""
+    ban_cache.pop(uid)
+    ban_version.bump()
+
+# --- HELPER: REQUEST-SCOPED USER LOADER ---
+def get_current_user():
+    """Return the logged-in user's snapshot, reading Firestore at most once per request.
+
+    ``login_required`` fills the cache on ``flask.g``; route handlers call this
+    again instead of fetching ``users/{uid}`` a second time.
+    """
+    if 'current_user' not in g:
+        uid = session.get('user_id')
+        g.current_user = repos.users.get(uid) if uid else None
+    return g.current_user
+
+def missing_user_logout():
+    """Log out a session whose ``users/{uid}`` document no longer exists.
+
+    ``login_required`` skips the user read on a ban-cache hit, so a user
+    deleted on another instance can still reach a handler; handlers that
+    load the user call this when the snapshot does not exist.
+    """
+    session.clear()
+    return redirect(url_for('auth'))
+
+# --- HELPER: TASK STATUS COUNTERS ---
+TASK_STATUSES = ('approved', 'pending', 'rejected')
+
+def task_stats_delta(old_status=None, new_status=None):
+    """Field updates that move one submission between the user's task_stats counters."""
+    delta = {}
+    if old_status in TASK_STATUSES:
+        delta[f'task_stats.{old_status}'] = firestore.Increment(-1)
+    if new_status in TASK_STATUSES:
+        delta[f'task_stats.{new_status}'] = firestore.Increment(1)
+    return delta
+
+# --- HELPER: REFERRAL PAGES ---
+REFERRAL_PAGE_SIZE = 20
+
+def referral_page(uid, cursor=None):
+    """Return one page of ``uid``'s referrals (newest first) and the cursor for the next page.
+
+    The cursor is an encode_page_token of the last row (created_at + doc id),
+    so people who joined in the same instant are neither skipped nor repeated
+    and every page costs at most REFERRAL_PAGE_SIZE reads.
+    """
+    query = repos.users.referred_by(uid)
+    if cursor:
+        key = decode_page_token(cursor)
+        query = query.start_after({'created_at': key['created_at'], '__name__': key['id']})
+
+    rows = list(query.limit(REFERRAL_PAGE_SIZE).stream())
+    referrals = [{'name': r.to_dict().get('name', 'Unknown'), 'joined': r.to_dict().get('created_at')}
+                 for r in rows]
+    next_cursor = None
+    if len(rows) == REFERRAL_PAGE_SIZE:
+        next_cursor = encode_page_token({'id': rows[-1].id, 'created_at': referrals[-1]['joined']}, 0)
+    return referrals, next_cursor
+
+# --- HELPER: SETTINGS CACHE ---
+settings_cache = SettingsCache(repos)
+if SETTINGS_LISTENER:
+    settings_cache.listen()
+
+# --- HELPER: MODERATION QUEUE ---
+# MODERATION_LISTENER=1 হলে পেন্ডিং কিউগুলো মেমরিতে থাকে (শুধু লং-রানিং ওয়ার্কারে)
+moderation_queue = ModerationQueue(repos)
+if MODERATION_LISTENER:
+    moderation_queue.listen()
+
+MODERATION_MACROS = {'submissions': 'submission_card', 'activations': 'activation_row', 'withdraws': 'withdraw_row'}
+
+def with_task_info(submissions):
+    """Add task_title/task_reward to submission dicts from the shared task catalog."""
+    task_map = {k: v for k, v in task_catalog.get_many([d.get('task_id') for d in submissions]).items() if v}
+    for sub_data in submissions:
+        task = task_map.get(sub_data.get('task_id'))
+        sub_data['task_title'] = task.get('title', 'Unknown') if task else "Deleted Task"
+        sub_data['task_reward'] = task.get('reward', 0) if task else 0
+    return submissions
+
+def pending_queues():
+    """First MODERATION_PAGE_SIZE items of each pending queue, plus what the admin page needs to go live."""
+    if moderation_queue.live:
+        version, queues, totals = moderation_queue.page(MODERATION_PAGE_SIZE)
+        more = {name: False for name in QUEUES}
+    else:
+        # এক ডকুমেন্ট বেশি পড়ে বোঝা যায় পরের পেজ আছে কিনা; পুরো কিউ আর স্ট্রিম হয় না
+        version, queues, more = None, {}, {}
+        for name in QUEUES:
+            docs = getattr(repos, name).pending().limit(MODERATION_PAGE_SIZE + 1).stream()
+            items = [{'id': d.id, **d.to_dict()} for d in docs]
+            queues[name], more[name] = items[:MODERATION_PAGE_SIZE], len(items) > MODERATION_PAGE_SIZE
+        totals = {name: len(items) for name, items in queues.items()}
+    with_task_info(queues['submissions'])
+    return queues, {'live': version is not None, 'version': version, 'page_size': MODERATION_PAGE_SIZE,
+                    'totals': totals, 'more': more}
+
+def moderation_event(event):
+    """Turn a ModerationQueue change into the JSON the admin page applies (upserts carry rendered HTML)."""
+    if event['op'] == 'remove':
+        return {'queue': event['queue'], 'op': 'remove', 'id': event['id']}
+    item = dict(event['item'])
+    if event['queue'] == 'submissions':
+        with_task_info([item])
+    render = get_template_attribute('moderation_items.html', MODERATION_MACROS[event['queue']])
+    return {'queue': event['queue'], 'op': 'upsert', 'id': event['id'], 'html': str(render(item, ADMIN_ROUTE))}
+
+# --- HELPER: DASHBOARD CACHE ---
+dashboard_cache = TTLCache(maxsize=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL)
+
+def dashboard_etag(uid, user_doc, user, system_notice):
+    """ETag of a user's dashboard.
+
+    Changes whenever ``users/{uid}`` is written (balance, task stats,
+    approvals, referrals; ``ledger.touch_user`` covers the rest), when
+    counter shard totals move, or when the system notice changes.
+    """
+    parts = (DEPLOY_ID, request.host_url, uid, session.get('is_admin'), user_doc.update_time,
+             user.get('balance'), user.get('referral_count'), json.dumps(system_notice, sort_keys=True, default=str))
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+# --- HELPER: NOTICE FEED ---
+notice_page_cache = TTLCache(maxsize=8, ttl=NOTICE_CACHE_TTL)
+notice_version = VersionStamp(repos, 'notices', staleness=NOTICE_CACHE_STALENESS)
+
+def notice_page(cursor=None):
+    """Return the newest NOTICE_PAGE_SIZE notices after ``cursor`` and the next cursor.
+
+    The cursor is an encode_page_token of the last notice (its ``date`` in
+    the created_at slot, plus the doc id), so notices posted in the same
+    instant are neither skipped nor repeated.
+    """
+    query = repos.notices.newest()
+    if cursor:
+        key = decode_page_token(cursor)
+        query = query.start_after({'date': key['created_at'], '__name__': key['id']})
+
+    notices = [{'id': n.id, **n.to_dict()} for n in query.limit(NOTICE_PAGE_SIZE).stream()]
+    next_cursor = None
+    if len(notices) == NOTICE_PAGE_SIZE:
+        next_cursor = encode_page_token({'id': notices[-1]['id'], 'created_at': notices[-1]['date']}, 0)
+    return notices, next_cursor
+
+def invalidate_notices():
+    """Drop the rendered notice pages here and on every other instance."""
+    notice_page_cache.clear()
+    notice_version.bump()
+
+def submission_id(uid, task_id):
+    """Deterministic task_submissions id, so the datastore itself rejects duplicates."""
+    return f"{uid}_{task_id}"
+
+# --- HELPER: TASK CATALOG CACHE ---
+task_catalog = TaskCatalog(repos)
+
+# --- HELPER: OPEN TASK PICKER ---
+TASKS_PER_PAGE = 2
+TASK_SCAN_BATCH = 10
+TASK_SCAN_PAGES = 3  # একবারে সর্বোচ্চ ৩০টি টাস্ক পড়া হয়, বাকিটা "আরও কাজ" লিংকে
+
+def pick_open_tasks(done_ids, cursor=None, wanted=TASKS_PER_PAGE):
+    """Walk the task catalog newest-first for ``wanted`` tasks not in ``done_ids``.
+
+    At most TASK_SCAN_PAGES batches are read per call, so a user who has
+    done most of the catalog still costs a bounded number of reads.
+    ``cursor`` is a token from a previous call (``decode_page_token``
+    raises ValueError if it is malformed). Returns ``(tasks, next_cursor)``;
+    ``next_cursor`` is None once the catalog is exhausted.
+    """
+    query = repos.tasks.newest().limit(TASK_SCAN_BATCH)
+    last = None
+    if cursor:
+        key = decode_page_token(cursor)
+        last = {'created_at': key['created_at'], '__name__': key['id']}
+
+    open_tasks = []
+    more = True
+    for _ in range(TASK_SCAN_PAGES):
+        page = list((query.start_after(last) if last else query).stream())
+        more = len(page) == TASK_SCAN_BATCH
+        for i, t in enumerate(page):
+            last = t
+            if t.id not in done_ids:  # যদি করা না থাকে
+                open_tasks.append({**t.to_dict(), 'id': t.id})
+                if len(open_tasks) >= wanted:
+                    more = more or i < len(page) - 1
+                    break
+        if len(open_tasks) >= wanted or not more:
+            break
+
+    next_cursor = encode_page_token({'id': last.id, **last.to_dict()}, 0) if more else None
+    return open_tasks, next_cursor
+
+# --- HELPER: LIST CURSORS (admin user list, task picker) ---
+USERS_PAGE_SIZE = 20
+
+def encode_page_token(row, page):
+    """Opaque URL token for a row of a created_at-ordered list (created_at + doc id + page number)."""
+    raw = json.dumps({'created_at': row['created_at'].isoformat(), 'id': row['id'], 'page': page})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_page_token(token):
+    """Inverse of encode_page_token; raises ValueError on anything malformed."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        cursor = {'created_at': datetime.datetime.fromisoformat(data['created_at']),
+                  'id': str(data['id']),
+                  'page': int(data['page'])}
+    except (TypeError, KeyError, binascii.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Bad page token: {e}")
+    if '/' in cursor['id']:
+        raise ValueError("Bad page token: invalid document id")
+    return cursor
+
 # --- UPDATED LOGIN DECORATOR (AUTO LOGOUT BANNED USER) ---
 from functools import wraps # এটি ইম্পোর্ট করা ভালো (ফাইলের উপরে ইম্পোর্ট সেকশনে না থাকলে সমস্যা নেই, তবে রাখা ভালো)
 
@@ -42,24 +310,29 @@ def login_required(f):
         if 'user_id' not in session:
             return redirect(url_for('auth'))
         
-        # ২. ডাটাবেস চেক (ব্যান কিনা দেখার জন্য)
+        # ২. ব্যান চেক (ক্যাশে থাকলে ডাটাবেসে যাওয়ার দরকার নেই)
         try:
             uid = session['user_id']
-            # শুধুমাত্র 'is_banned' ফিল্ডটি চেক করার জন্য হালকা কুয়েরি
-            user_doc = db.collection('users').document(uid).get(['is_banned'])
-            
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                
-                # ⛔ যদি ইউজার BANNED হয়
-                if user_data.get('is_banned', False):
-                    session.clear() # সেশন ডিলিট
-                    flash("Your account has been BANNED by Admin.", "error")
-                    return redirect(url_for('auth')) # লগইন পেজে পাঠিয়ে দিবে
-            else:
-                # যদি ডাটাবেসে ইউজার না থাকে (ডিলিট হয়ে যায়)
-                session.clear()
-                return redirect(url_for('auth'))
+            if ban_version.changed():
+                ban_cache.clear()
+
+            is_banned = ban_cache.get(uid)
+            if is_banned is None:
+                # পুরো ডকুমেন্ট একবারই পড়া হয়, হ্যান্ডলারগুলো g থেকে আবার ব্যবহার করবে
+                user_doc = get_current_user()
+
+                if not user_doc.exists:
+                    # যদি ডাটাবেসে ইউজার না থাকে (ডিলিট হয়ে যায়)
+                    return missing_user_logout()
+
+                is_banned = user_doc.to_dict().get('is_banned', False)
+                ban_cache.set(uid, is_banned)
+
+            # ⛔ যদি ইউজার BANNED হয়
+            if is_banned:
+                session.clear() # সেশন ডিলিট
+                flash("Your account has been BANNED by Admin.", "error")
+                return redirect(url_for('auth')) # লগইন পেজে পাঠিয়ে দিবে
                 
         except Exception as e:
             print(f"Security Check Error: {e}")
@@ -77,16 +350,17 @@ def admin_required(f):
     wrapper.__name__ = f.__name__
     return wrapper
 
-def upload_to_imgbb(image_file):
+def upload_to_imgbb(image_file, timeout=None):
+    import requests  # শুধু আপলোড ওয়ার্কারে লাগে, কোল্ড স্টার্টে লোড হয় না
     try:
-        url = "https://api.imgbb.com/1/upload"
         payload = {
             "key": IMGBB_API_KEY,
         }
         files = {
-            "image": image_file.read()
+            "image": image_file
         }
-        response = requests.post(url, data=payload, files=files)
+        with metrics.track_http('imgbb'):
+            response = requests.post(IMGBB_UPLOAD_URL, data=payload, files=files, timeout=timeout or UPLOAD_TIMEOUT)
         data = response.json()
         if data['success']:
             return data['data']['url']
@@ -94,55 +368,19 @@ def upload_to_imgbb(image_file):
         print(f"Upload Error: {e}")
     return None
 
-# --- HELPER: AUTOMATIC CLEANUP FUNCTION ---
-def cleanup_old_data():
-    try:
-        # ১৫ দিন আগের সময় বের করা
-        cutoff_date = datetime.datetime.now() - timedelta(days=15)
-        
-        # ১. Task Submissions ডিলিট
-        old_tasks = db.collection('task_submissions').where(
-            field_path='timestamp', op_string='<', value=cutoff_date
-        ).limit(50).stream()
-        
-        for doc in old_tasks:
-            doc.reference.delete()
-
-        # ২. Balance History ডিলিট
-        old_history = db.collection('balance_history').where(
-            field_path='timestamp', op_string='<', value=cutoff_date
-        ).limit(50).stream()
-        
-        for doc in old_history:
-            doc.reference.delete()
-
-        # ৩. Withdraw Requests (শুধুমাত্র Paid/Rejected) ডিলিট
-        old_withdraws = db.collection('withdraw_requests').where(
-            field_path='timestamp', op_string='<', value=cutoff_date
-        ).limit(50).stream()
-        
-        for doc in old_withdraws:
-            data = doc.to_dict()
-            if data.get('status') in ['paid', 'rejected']:
-                doc.reference.delete()
-                
-    except Exception as e:
-        print(f"Cleanup Error: {e}")
+# প্রুফ ইমেজ আপলোড: ডিফল্টে রিকোয়েস্টের ভেতরেই একবার (ছোট টাইমআউটে), UPLOAD_BACKGROUND=1 হলে ব্যাকগ্রাউন্ড ওয়ার্কারে রিট্রাই সহ
+upload_pipeline = UploadPipeline(upload_to_imgbb)
 
 # --- HELPER: SEND TELEGRAM NOTIFICATION ---
+# ডিফল্টে রিকোয়েস্টের ভেতরেই টেলিগ্রামে পাঠানো হয় (সার্ভারলেসে কিউ হারিয়ে যায়); NOTIFY_BACKGROUND=1 হলে ব্যাকগ্রাউন্ড থ্রেড
+notifier = NotificationDispatcher(TelegramSender(
+    bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+    chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+    api_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org") # লোকাল স্টাব দিয়ে টেস্ট করার জন্য
+))
+
 def send_telegram_alert(message):
-    try:
-        bot_token = "8400750468:AAEtGwUSCot8ecBXog29qehvcZXL9rqv_fA"
-        chat_id = "8571316406"
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        requests.post(url, json=payload)
-    except Exception as e:
-        print(f"Telegram Error: {e}")
+    notifier.send(message)
 # --- ROUTES ---
 @app.route('/')
 def index():
@@ -166,87 +404,52 @@ def session_login():
     
     try:
         # ১. টোকেন ভেরিফাই করা
+        from firebase_admin import auth as admin_auth
+        ensure_firebase_app()  # কোল্ড স্টার্টে db এখনো তৈরি না হলেও Auth এর জন্য অ্যাপ লাগবে
         decoded_token = admin_auth.verify_id_token(id_token)
         uid = decoded_token['uid']
         email = decoded_token['email']
         
-        user_ref = db.collection('users').document(uid)
-        user_doc = user_ref.get()
-        
-        # --- [STEP 1] BAN CHECK (যদি ইউজার আগে থেকেই থাকে) ---
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            if user_data.get('is_banned', False):
-                return jsonify({"status": "error", "message": "Your account has been BANNED by Admin."}), 403
-
-        # --- [STEP 2] NEW USER REGISTRATION (যদি ইউজার না থাকে) ---
+        user_ref = repos.users.ref(uid)
+        refs = [user_ref]
+        if ref_code and ref_code != uid and '/' not in ref_code:
+            refs.append(repos.users.ref(ref_code))
+        # ইউজার ও রেফারার একই RPC তে পড়া হয়
+        docs = {doc.id: doc for doc in repos.get_all(refs)}
+        user_doc = docs[uid]
+
+        # --- [STEP 1] NEW USER REGISTRATION (যদি ইউজার না থাকে) ---
         if not user_doc.exists:
             # নাম না থাকলে ইমেইল থেকে নাম বানানো
             if not name: 
                 name = email.split('@')[0]
 
-            initial_balance = 0.0
-            referred_by_uid = None
-
-            # --- REFERRAL LOGIC ---
-            if ref_code and ref_code != uid:
-                referrer_ref = db.collection('users').document(ref_code)
-                referrer_doc = referrer_ref.get()
-                
-                if referrer_doc.exists:
-                    referred_by_uid = ref_code
-                    
-                    # A. নতুন ইউজারকে বোনাস (৫ টাকা)
-                    initial_balance = 10.0 
-                    
-                    # B. যে রেফার করেছে তাকে বোনাস (৫ টাকা)
-                    referrer_data = referrer_doc.to_dict()
-                    new_ref_balance = referrer_data.get('balance', 0) + 10.0
-                    new_ref_count = referrer_data.get('referral_count', 0) + 1
-                    
-                    referrer_ref.update({
-                        'balance': new_ref_balance,
-                        'referral_count': new_ref_count
-                    })
-                    
-                    # History Log (Referrer)
-                    db.collection('balance_history').add({
-                        'uid': ref_code,
-                        'type': 'referral_bonus',
-                        'amount': 5.0,
-                        'description': f'Referral Bonus: {name}',
-                        'timestamp': datetime.datetime.now()
-                    })
-
-                    # History Log (New User)
-                    db.collection('balance_history').add({
-                        'uid': uid,
-                        'type': 'signup_bonus',
-                        'amount': 5.0,
-                        'description': 'Welcome Bonus',
-                        'timestamp': datetime.datetime.now()
-                    })
-            # --- END REFERRAL LOGIC ---
-
-            # নতুন ইউজার সেভ করা
+            referrer_doc = docs.get(ref_code) if len(refs) > 1 else None
             new_user_data = {
                 'email': email,
                 'name': name,
                 'fb_link': fb_link,
-                'balance': initial_balance,
+                'balance': 0.0,
                 'role': 'user',
                 'is_banned': False, # ডিফল্ট ভাবে ব্যান ফলস থাকবে
                 'is_active': False, # একাউন্ট ফি না দেওয়া পর্যন্ত ইনঅ্যাক্টিভ
                 'created_at': datetime.datetime.now(),
                 'referral_count': 0,
-                'referred_by': referred_by_uid
+                'referred_by': None
             }
-            user_ref.set(new_user_data)
-            is_admin = False
-            
-        else:
-            # যদি ইউজার থাকে, তার রোল চেক করা
-            is_admin = user_doc.to_dict().get('role') == 'admin'
+            try:
+                # ইউজার, সাইনআপ বোনাস ও রেফারেল ক্রেডিট একই কমিটে
+                ledger.register_user(repos, user_ref, new_user_data,
+                                     referrer_doc if referrer_doc and referrer_doc.exists else None)
+            except firestore.AlreadyExists:
+                # একই ইউজারের দুটি লগইন একসাথে এলে একটিই একাউন্ট বানায়; এটি সাধারণ লগইন হিসেবে চলবে
+                user_doc = user_ref.get()
+
+        # --- [STEP 2] BAN CHECK (যদি ইউজার আগে থেকেই থাকে) ---
+        user_data = user_doc.to_dict() if user_doc.exists else {}
+        if user_data.get('is_banned', False):
+            return jsonify({"status": "error", "message": "Your account has been BANNED by Admin."}), 403
+        is_admin = user_data.get('role') == 'admin'
 
         # --- [STEP 3] CREATE SESSION ---
         session.permanent = True
@@ -264,8 +467,9 @@ def session_login():
 @app.route('/kyc', methods=['GET'])
 @login_required
 def kyc_form():
-    uid = session['user_id']
-    user_doc = db.collection('users').document(uid).get()
+    user_doc = get_current_user()
+    if not user_doc.exists:
+        return missing_user_logout()
     user = user_doc.to_dict()
 
     # যদি অলরেডি সাবমিট করে থাকে, ড্যাশবোর্ডে পাঠিয়ে দাও
@@ -279,7 +483,7 @@ def kyc_form():
 @login_required
 def submit_kyc():
     uid = session['user_id']
-    user_ref = db.collection('users').document(uid)
+    user_ref = repos.users.ref(uid)
     
     # 1. ডাটা সংগ্রহ
     name = request.form.get('name')
@@ -296,18 +500,21 @@ def submit_kyc():
         ip_address = request.remote_addr
 
     # 2. ডাটাবেসে আপডেট (KYC Done Mark)
-    user_ref.update({
-        'kyc_submitted': True,
-        'phone': phone,
-        'kyc_data': {
-            'name': name,
-            'address': address,
-            'dob': dob,
-            'education': education,
-            'ip': ip_address,
-            'timestamp': datetime.datetime.now()
-        }
-    })
+    try:
+        user_ref.update({
+            'kyc_submitted': True,
+            'phone': phone,
+            'kyc_data': {
+                'name': name,
+                'address': address,
+                'dob': dob,
+                'education': education,
+                'ip': ip_address,
+                'timestamp': datetime.datetime.now()
+            }
+        })
+    except firestore.NotFound:
+        return missing_user_logout()
 
     # 3. টেলিগ্রামে মেসেজ পাঠানো
     msg = f"""
@@ -340,72 +547,142 @@ def logout():
 @login_required
 def dashboard():
     uid = session['user_id']
-    
-    # ১. ইউজার ডাটা
-    user_doc = db.collection('users').document(uid).get()
+
+    # ১. ইউজার ডাটা (ব্যান ক্যাশ হিট হলে এটিই একমাত্র পয়েন্ট রিড)
+    user_doc = get_current_user()
     if not user_doc.exists:
-        session.clear()
-        return redirect(url_for('auth'))
-    user = user_doc.to_dict()
-    
-    # ২. হিস্টোরি (৫০টি)
-    balance_history = db.collection('balance_history')\
-        .where(field_path='uid', op_string='==', value=uid)\
-        .order_by('timestamp', direction=Query.DESCENDING).limit(50).stream()
-    history = [h.to_dict() for h in balance_history]
-
-    # ৩. রেফারেলস
-    referrals_stream = db.collection('users')\
-        .where(field_path='referred_by', op_string='==', value=uid).stream()
-    referrals = [{'name': r.to_dict().get('name', 'Unknown'), 'joined': r.to_dict().get('created_at')} for r in referrals_stream]
-
-    # ৪. টাস্ক স্ট্যাটস
-    all_tasks = db.collection('task_submissions').where(field_path='uid', op_string='==', value=uid).stream()
-    stats = {'approved': 0, 'pending': 0, 'rejected': 0}
-    for t in all_tasks:
-        status = t.to_dict().get('status')
-        if status in stats: stats[status] += 1
-
-    # ✅ ৫. সিস্টেম নোটিশ আনা (NEW)
-    notice_doc = db.collection('settings').document('system_notice').get()
-    system_notice = notice_doc.to_dict() if notice_doc.exists else None
-
-    return render_template('dashboard.html', 
-                           user=user, 
-                           history=history, 
-                           referrals=referrals, 
-                           stats=stats,
-                           system_notice=system_notice, # নতুন ডাটা পাস করা হলো
-                           uid=uid)
+        return missing_user_logout()
+    user = counters.with_shard_totals(repos, uid, user_doc.to_dict())
+    system_notice = settings_cache.get('system_notice')  # ✅ ৫. সিস্টেম নোটিশ (ক্যাশ থেকে)
+
+    def render():
+        # ২. হিস্টোরি (৫০টি)
+        def load_history():
+            balance_history = repos.ledger.for_user(uid).limit(50).stream()
+            return [h.to_dict() for h in balance_history]
+
+        # সব কুয়েরি একসাথে চালানো হয়, পেজ লোড = সবচেয়ে ধীর কুয়েরির সময়
+        results = fan_out({
+            'history': load_history,
+            'referrals': lambda: referral_page(uid),  # ৩. রেফারেলস (শুধু প্রথম পেজ)
+        }, prefix='dashboard.', defaults={
+            'history': [],
+            'referrals': ([], None),
+        })
+        referrals, referral_cursor = results['referrals']
+
+        # ৪. টাস্ক স্ট্যাটস (ইউজার ডকের কাউন্টার থেকে, আলাদা কুয়েরি লাগে না)
+        stats = {status: 0 for status in TASK_STATUSES}
+        stats.update(user.get('task_stats') or {})
+
+        html = render_template('dashboard.html', 
+                               user=user, 
+                               history=results['history'], 
+                               referrals=referrals, 
+                               referral_cursor=referral_cursor,
+                               stats=stats,
+                               system_notice=system_notice, # নতুন ডাটা পাস করা হলো
+                               uid=uid)
+        return html, bool(results.fell_back)
+
+    if session.get('_flashes'):
+        # ফ্ল্যাশ মেসেজ সহ পেজ ক্যাশ বা 304 করা যাবে না
+        return render()[0]
+
+    etag = dashboard_etag(uid, user_doc, user, system_notice)
+    page = dashboard_cache.get(uid)
+    if request.if_none_match.contains(etag):
+        html = ''  # ব্রাউজারের কপিই ঠিক আছে: কুয়েরি বা রেন্ডার ছাড়াই 304
+    elif page is not None and page[0] == etag:
+        html = page[1]
+    else:
+        html, degraded = render()
+        if degraded:
+            # কোনো কুয়েরি ফেল/টাইমআউট হলে অসম্পূর্ণ পেজ ক্যাশ বা ETag পাবে না, পরের লোডে আবার চেষ্টা
+            response = make_response(html)
+            response.cache_control.no_store = True
+            return response
+        dashboard_cache.set(uid, (etag, html))
+
+    response = make_response(html)
+    response.set_etag(etag)
+    # ব্রাউজার প্রতিবার যাচাই করবে, কিছু না বদলালে 304 পাবে
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+@app.route('/referrals')
+@login_required
+def referral_list():
+    # ড্যাশবোর্ডের "Load more" বাটনের জন্য পরের পেজ (JSON)
+    try:
+        page, next_cursor = referral_page(session['user_id'], request.args.get('cursor'))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+
+    return jsonify({
+        "status": "success",
+        "referrals": [{'name': r['name'], 'joined': r['joined'].strftime('%d %b') if r['joined'] else ''} for r in page],
+        "next_cursor": next_cursor
+    })
 
 
 # --- 1. NEW ROUTE FOR USER MANAGEMENT (Add this block) ---
 @app.route(f'/{ADMIN_ROUTE}/ui')
 @admin_required
 def manage_users():
-    # Pagination Logic
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    offset = (page - 1) * per_page
-
-    # Fetch Users
-    users_stream = db.collection('users')\
-        .order_by('created_at', direction=Query.DESCENDING)\
-        .offset(offset)\
-        .limit(per_page)\
-        .stream()
-        
-    users_list = [{'id': d.id, **d.to_dict()} for d in users_stream]
-    
-    # Simple pagination check
-    has_next = len(users_list) == per_page
-    has_prev = page > 1
+    # Keyset pagination: প্রতিটি পেজ (যত গভীরই হোক) শুধু per_page+1 রিড খরচ করে
+    per_page = USERS_PAGE_SIZE
+    try:
+        if request.args.get('before'):
+            cursor = decode_page_token(request.args['before'])
+            page = cursor['page'] - 1
+            direction = 'before'
+        elif request.args.get('after'):
+            cursor = decode_page_token(request.args['after'])
+            page = cursor['page'] + 1
+            direction = 'after'
+        else:
+            cursor, page, direction = None, 1, None
+    except ValueError:
+        flash("Invalid page link.", "error")
+        return redirect(url_for('manage_users'))
+
+    query = repos.users.newest()
+    key = {'created_at': cursor['created_at'], '__name__': cursor['id']} if cursor else None
+
+    if direction == 'before':
+        # আগের পেজ: কার্সরের আগের শেষ per_page+1 টি (একটি বেশি এনে দেখা হয় আরো আগে কিছু আছে কিনা)
+        docs = query.end_before(key).limit_to_last(per_page + 1).get()
+        has_prev = len(docs) > per_page
+        docs = docs[-per_page:]
+        has_next = True
+    else:
+        if key:
+            query = query.start_after(key)
+        docs = list(query.limit(per_page + 1).stream())
+        has_next = len(docs) > per_page
+        docs = docs[:per_page]
+        has_prev = direction == 'after'
+    page = max(page, 1)
+    has_prev = has_prev and page > 1
+
+    users_list = [{'id': d.id, **d.to_dict()} for d in docs]
+    prev_token = encode_page_token(users_list[0], page) if users_list and has_prev else None
+    next_token = encode_page_token(users_list[-1], page) if users_list and has_next else None
+
+    # মোট ইউজার সংখ্যা (count aggregation, ডকুমেন্ট পড়ে না)
+    total_users = repos.users.count()
 
     return render_template('manage_users.html', 
                            users=users_list,
                            page=page,
-                           has_next=has_next,
-                           has_prev=has_prev,
+                           total_users=total_users,
+                           per_page=per_page,
+                           prev_token=prev_token,
+                           next_token=next_token,
                            admin_route=ADMIN_ROUTE)
 
 # --- 2. UPDATE ACTION ROUTES (Redirect to new page) ---
@@ -413,7 +690,8 @@ def manage_users():
 @app.route(f'/{ADMIN_ROUTE}/ban_user/<uid>')
 @admin_required
 def ban_user(uid):
-    db.collection('users').document(uid).update({'is_banned': True})
+    repos.users.ref(uid).update({'is_banned': True})
+    invalidate_ban_state(uid)
     flash("User BANNED.", "success")
     # Redirect back to user list
     return redirect(f'/{ADMIN_ROUTE}/users')
@@ -421,14 +699,16 @@ def ban_user(uid):
 @app.route(f'/{ADMIN_ROUTE}/unban_user/<uid>')
 @admin_required
 def unban_user(uid):
-    db.collection('users').document(uid).update({'is_banned': False})
+    repos.users.ref(uid).update({'is_banned': False})
+    invalidate_ban_state(uid)
     flash("User UNBANNED.", "success")
     return redirect(f'/{ADMIN_ROUTE}/users')
 
 @app.route(f'/{ADMIN_ROUTE}/delete_user/<uid>')
 @admin_required
 def delete_user(uid):
-    db.collection('users').document(uid).delete()
+    repos.users.ref(uid).delete()
+    invalidate_ban_state(uid)
     flash("User DELETED.", "success")
     return redirect(f'/{ADMIN_ROUTE}/users')
 
@@ -444,62 +724,72 @@ def tasks():
     if request.method == 'POST':
         task_id = request.form.get('task_id')
         
-        # ডুপ্লিকেট সাবমিশন চেক
-        existing = db.collection('task_submissions').where(
-            field_path='uid', op_string='==', value=uid
-        ).where(
-            field_path='task_id', op_string='==', value=task_id
-        ).get()
-        
-        if existing:
+        # ডুপ্লিকেট সাবমিশন চেক (ইউজার ডকের সেট থেকে, কুয়েরি ছাড়া)
+        user_doc = get_current_user()
+        if not user_doc.exists:
+            return missing_user_logout()
+        user = user_doc.to_dict()
+        if not task_id or '/' in task_id or task_id in user.get('completed_task_ids', []):
             flash("Already submitted!", "error")
             return redirect(url_for('tasks'))
 
-        # সাবমিশন সেভ করা
-        db.collection('task_submissions').add({
+        # সাবমিশন সেভ করা: uid+task_id দিয়ে নির্দিষ্ট আইডি, একই কাজ দুবার জমা হলে create() ফেল করবে
+        has_image = 'image' in request.files
+        sub_ref = repos.submissions.ref(submission_id(uid, task_id))
+        sub_data = {
             'uid': uid,
             'task_id': task_id,
             'status': 'pending',
             'timestamp': datetime.datetime.now(),
             'email': session['email'],
-            'proof': upload_to_imgbb(request.files['image']) if 'image' in request.files else request.form.get('proof_text'),
-            'proof_type': 'image' if 'image' in request.files else 'text'
+            'proof': None if has_image else request.form.get('proof_text'),
+            'proof_type': 'image' if has_image else 'text'
+        }
+        if has_image:
+            sub_data['upload_status'] = 'pending' # আপলোড শেষ হলে URL বসানো হবে
+
+        batch = repos.batch()
+        batch.create(sub_ref, sub_data)
+        batch.update(repos.users.ref(uid), {
+            **task_stats_delta(new_status='pending'),
+            'completed_task_ids': firestore.ArrayUnion([task_id])
         })
+        try:
+            batch.commit()
+        except firestore.AlreadyExists:
+            flash("Already submitted!", "error")
+            return redirect(url_for('tasks'))
+        except firestore.NotFound:
+            return missing_user_logout()
+
+        if has_image:
+            upload_pipeline.submit(sub_ref, request.files['image'])
         flash("Task submitted successfully!", "success")
         return redirect(url_for('tasks'))
 
     # --- 2. GET ONLY 2 TASKS (QUOTA SAVER) ---
     
-    # ইউজার কোন কাজগুলো করেছে তার লিস্ট
-    user_subs = db.collection('task_submissions').where(field_path='uid', op_string='==', value=uid).stream()
-    done_ids = [s.to_dict().get('task_id') for s in user_subs]
+    # ইউজার কোন কাজগুলো করেছে তার সেট (ইউজার ডকেই রাখা, আলাদা কুয়েরি লাগে না)
+    user_doc = get_current_user()
+    if not user_doc.exists:
+        return missing_user_logout()
+    done_ids = set(user_doc.to_dict().get('completed_task_ids', []))
 
-    # ডাটাবেস থেকে লেটেস্ট ১০টি টাস্ক আনা (যাতে ফিল্টার করে অন্তত ২টা পাওয়া যায়)
-    # limit(10) দেওয়া হয়েছে সেফটির জন্য, কিন্তু আমরা লুপ ব্রেক করে ২টাই নিব।
-    tasks_query = db.collection('tasks').order_by('created_at', direction=Query.DESCENDING).limit(10).stream()
-    
-    final_tasks = []
-    count = 0
-
-    for t in tasks_query:
-        if t.id not in done_ids: # যদি করা না থাকে
-            t_data = t.to_dict()
-            t_data['id'] = t.id
-            final_tasks.append(t_data)
-            count += 1
-            
-            # ✅ ২টা টাস্ক পাওয়া গেলে লুপ থামিয়ে দিবে
-            if count >= 2:
-                break
+    try:
+        final_tasks, next_cursor = pick_open_tasks(done_ids, request.args.get('after'))
+    except ValueError:
+        return redirect(url_for('tasks'))
 
-    return render_template('tasks.html', tasks=final_tasks)
+    return render_template('tasks.html', tasks=final_tasks, next_cursor=next_cursor)
 
 @app.route('/withdraw', methods=['GET', 'POST'])
 @login_required
 def withdraw():
     uid = session['user_id']
-    user_ref = db.collection('users').document(uid)
-    user = user_ref.get().to_dict()
+    user_doc = get_current_user()
+    if not user_doc.exists:
+        return missing_user_logout()
+    user = counters.with_shard_totals(repos, uid, user_doc.to_dict())
 
     # ⛔ KYC CHECK (NEW) ⛔
     if not user.get('kyc_submitted', False):
@@ -535,26 +825,16 @@ def withdraw():
 
             # --- 4. SUCCESS: PROCESS WITHDRAW ---
             # সব শর্ত ঠিক থাকলে এবং একাউন্ট অ্যাক্টিভ থাকলে
-            db.collection('withdraw_requests').add({
-                'uid': uid,
-                'email': session['email'],
-                'amount': amount,
-                'method': method,
-                'number': number,
-                'status': 'pending',
-                'timestamp': datetime.datetime.now()
-            })
-            
-            # ব্যালেন্স কাটা
-            user_ref.update({'balance': user['balance'] - amount})
-            
-            # হিস্টোরি লগ
-            db.collection('balance_history').add({
-                'uid': uid,
-                'type': 'withdraw_hold',
-                'amount': -amount,
-                'timestamp': datetime.datetime.now()
-            })
+            # রিকোয়েস্ট, ব্যালেন্স কাটা ও হিস্টোরি লগ একটি ট্রানজ্যাকশনে (ডাবল উইথড্র সম্ভব নয়)
+            try:
+                ledger.hold_for_withdraw(repos, uid, amount, {
+                    'email': session['email'],
+                    'method': method,
+                    'number': number
+                })
+            except ledger.InsufficientBalance:
+                flash("Insufficient wallet balance.", "error")
+                return redirect(url_for('withdraw'))
             
             flash("Withdraw request sent successfully!", "success")
             return redirect(url_for('withdraw'))
@@ -571,7 +851,7 @@ def submit_activation():
     uid = session['user_id']
     
     # ডাটাবেসে রিকোয়েস্ট জমা রাখা (Admin Panel এ দেখানোর জন্য)
-    db.collection('activation_requests').add({
+    repos.activations.add({
         'uid': uid,
         'email': session['email'],
         'method': request.form.get('method'),
@@ -592,7 +872,7 @@ def admin_panel():
         if 'create_task' in request.form:
             try:
                 task_link = request.form.get('task_link') or ""
-                db.collection('tasks').add({
+                task_data = {
                     'title': request.form.get('title'),
                     'category': request.form.get('category'),
                     'task_link': task_link,
@@ -600,59 +880,86 @@ def admin_panel():
                     'reward': float(request.form.get('reward')),
                     'proof_requirement': request.form.get('proof_requirement'),
                     'created_at': datetime.datetime.now()
-                })
+                }
+                _, task_ref = repos.tasks.add(task_data)
+                task_catalog.put(task_ref.id, task_data)
                 flash("New Task Published!", "success")
             except Exception as e:
                 flash(f"Error: {e}", "error")
         
         elif 'update_system_notice' in request.form:
             # ... (Notice Logic Same) ...
-            db.collection('settings').document('system_notice').set({
+            settings_cache.set('system_notice', {
                 'text': request.form.get('notice_text'),
                 'link': request.form.get('notice_link'),
                 'updated_at': datetime.datetime.now()
             })
             flash("System Notice Updated!", "success")
 
-    # --- DATA FETCHING (OPTIMIZED) ---
-    
-    # 1. Map Task Titles/Rewards (Efficiently)
-    all_tasks_ref = db.collection('tasks').stream()
-    task_map = {t.id: t.to_dict() for t in all_tasks_ref}
-
-    # 2. Only Fetch Pending Submissions
-    p_tasks = db.collection('task_submissions').where(field_path='status', op_string='==', value='pending').stream()
-    pending_tasks = []
-    
-    for sub in p_tasks:
-        sub_data = sub.to_dict()
-        task_id = sub_data.get('task_id')
-        
-        if task_id in task_map:
-            sub_data['task_title'] = task_map[task_id].get('title', 'Unknown')
-            sub_data['task_reward'] = task_map[task_id].get('reward', 0)
-        else:
-            sub_data['task_title'] = "Deleted Task"
-            sub_data['task_reward'] = 0
-            
-        sub_data['id'] = sub.id
-        pending_tasks.append(sub_data)
+        elif 'update_balance' in request.form:
+            # ব্যালেন্স সরাসরি সেট হয় না, লেজারে admin_adjustment হিসেবে যোগ/বিয়োগ হয়
+            try:
+                amount = float(request.form.get('amount'))
+                if request.form.get('action_type') != 'add':
+                    amount = -amount
+                ledger.post(repos, request.form.get('target_uid'), amount, 'admin_adjustment')
+                flash("User balance updated.", "success")
+            except (TypeError, ValueError):
+                flash("Invalid amount.", "error")
+            except firestore.NotFound:
+                flash("User not found.", "error")
 
-    # 3. Activation & Withdraw Requests
-    act_reqs = db.collection('activation_requests').where(field_path='status', op_string='==', value='pending').stream()
-    activation_requests = [{'id': d.id, **d.to_dict()} for d in act_reqs]
-    
-    p_withdraws = db.collection('withdraw_requests').where(field_path='status', op_string='==', value='pending').stream()
-    pending_withdraws = [{'id': d.id, **d.to_dict()} for d in p_withdraws]
+        elif 'publish_notice' in request.form:
+            try:
+                repos.notices.add({
+                    'title': request.form.get('title'),
+                    'message': request.form.get('message'),
+                    'date': datetime.datetime.now()
+                })
+                invalidate_notices()
+                flash("Notice Published Successfully!", "success")
+            except Exception as e:
+                flash(f"Error: {e}", "error")
 
-    # Auto Cleanup
-    cleanup_old_data()
+    # --- DATA FETCHING (OPTIMIZED) ---
+    # প্রতিটি কিউয়ের প্রথম পেজ (লাইভ কিউ চালু থাকলে মেমরি থেকে, ফায়ারস্টোর রিড ছাড়াই)
+    queues, moderation = pending_queues()
 
     return render_template('admin.html', 
-                           pending_tasks=pending_tasks, 
-                           pending_withdraws=pending_withdraws,
-                           activation_requests=activation_requests)
+                           pending_tasks=queues['submissions'], 
+                           pending_withdraws=queues['withdraws'],
+                           activation_requests=queues['activations'],
+                           moderation=moderation)
+
 
+# --- LIVE MODERATION STREAM (Server-Sent Events) ---
+@app.route(f'/{ADMIN_ROUTE}/moderation/stream')
+@admin_required
+def moderation_stream():
+    # লাইভ কিউ বন্ধ থাকলে 204: EventSource আর রিকানেক্ট করে না
+    if not moderation_queue.live:
+        return Response(status=204)
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', ''))
+    except ValueError:
+        since = None
+
+    def events(version):
+        # স্ট্রিম নির্দিষ্ট সময় পর বন্ধ হয়; ব্রাউজার Last-Event-ID দিয়ে আবার যুক্ত হয়
+        deadline = time.monotonic() + MODERATION_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            version, changes, totals = moderation_queue.changes_since(version, timeout=MODERATION_KEEPALIVE)
+            if changes is None:
+                yield "event: reload\ndata: {}\n\n"
+                return
+            if not changes:
+                yield ": keepalive\n\n"
+                continue
+            payload = {'changes': [moderation_event(change) for change in changes], 'totals': totals}
+            yield f"id: {version}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(stream_with_context(events(since)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # --- NEW: BULK APPROVE ROUTE ---
 @app.route(f'/{ADMIN_ROUTE}/bulk_approve', methods=['POST'])
@@ -664,124 +971,21 @@ def bulk_approve_tasks():
         flash("No tasks selected.", "error")
         return redirect(f'/{ADMIN_ROUTE}')
         
-    count = 0
-    for sub_id in selected_ids:
-        sub_ref = db.collection('task_submissions').document(sub_id)
-        sub_doc = sub_ref.get()
-        
-        if sub_doc.exists:
-            sub_data = sub_doc.to_dict()
-            if sub_data['status'] == 'pending':
-                # Get Reward
-                task_id = sub_data.get('task_id')
-                task_doc = db.collection('tasks').document(task_id).get()
-                reward = 0
-                if task_doc.exists:
-                    reward = task_doc.to_dict().get('reward', 0)
-                
-                # Update Balance
-                user_ref = db.collection('users').document(sub_data['uid'])
-                user_data = user_ref.get().to_dict()
-                if user_data:
-                    current_bal = user_data.get('balance', 0.0)
-                    user_ref.update({'balance': current_bal + reward})
-                
-                # Mark Approved
-                sub_ref.update({'status': 'approved'})
-                
-                # Add History
-                db.collection('balance_history').add({
-                    'uid': sub_data['uid'],
-                    'type': 'task_earning',
-                    'amount': reward,
-                    'description': 'Bulk Approved Task',
-                    'timestamp': datetime.datetime.now()
-                })
-                count += 1
-                
-    flash(f"Successfully Approved {count} Tasks!", "success")
+    results = bulk_approve(repos, task_catalog, selected_ids)
+    counts = {}
+    for outcome in results.values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    # প্রতিটি আইটেমের ফলাফল আলাদা করে জানানো হয়
+    if counts.get('failed'):
+        flash(f"{counts['failed']} tasks could not be approved. Please retry.", "error")
+    if counts.get('not_pending'):
+        flash(f"{counts['not_pending']} tasks skipped (already processed).", "error")
+    if counts.get('not_found'):
+        flash(f"{counts['not_found']} tasks skipped (not found).", "error")
+    flash(f"Successfully Approved {counts.get('approved', 0)} Tasks!", "success")
     return redirect(f'/{ADMIN_ROUTE}')
-@admin_required
-def admin_panel():
-    # --- 1. HANDLE POST REQUESTS ---
-    if request.method == 'POST':
-        # Create Task
-        if 'create_task' in request.form:
-            try:
-                task_link = request.form.get('task_link')
-                if not task_link: task_link = ""
-
-                db.collection('tasks').add({
-                    'title': request.form.get('title'),
-                    'category': request.form.get('category'),
-                    'task_link': task_link,
-                    'description': request.form.get('description'),
-                    'reward': float(request.form.get('reward')),
-                    'proof_requirement': request.form.get('proof_requirement'),
-                    'created_at': datetime.datetime.now()
-                })
-                flash("New Task Published!", "success")
-            except Exception as e:
-                flash(f"Error: {e}", "error")
-
-        # Update User Balance
-        elif 'update_balance' in request.form:
-            target_uid = request.form.get('target_uid')
-            new_amount = float(request.form.get('amount'))
-            action_type = request.form.get('action_type')
-            
-            user_ref = db.collection('users').document(target_uid)
-            user_data = user_ref.get().to_dict()
-            if user_data:
-                current_bal = user_data.get('balance', 0.0)
-                final_bal = (current_bal + new_amount) if action_type == 'add' else (current_bal - new_amount)
-                user_ref.update({'balance': final_bal})
-                flash("User balance updated.", "success")
-# [NEW] Update System Notice (Dashboard)
-        elif 'update_system_notice' in request.form:
-            notice_text = request.form.get('notice_text')
-            notice_link = request.form.get('notice_link')
-            
-            db.collection('settings').document('system_notice').set({
-                'text': notice_text,
-                'link': notice_link,
-                'updated_at': datetime.datetime.now()
-            })
-            flash("System Notice Updated on Dashboard!", "success")
-# [NEW] Publish Global Notice
-        elif 'publish_notice' in request.form:
-            try:
-                db.collection('notices').add({
-                    'title': request.form.get('title'),
-                    'message': request.form.get('message'),
-                    'date': datetime.datetime.now()
-                })
-                flash("Notice Published Successfully!", "success")
-            except Exception as e:
-                flash(f"Error: {e}", "error")
-    # --- 2tt. DATA FETCHING ---
-    
-    # Pending Tasks
-    p_tasks = db.collection('task_submissions').where(field_path='status', op_string='==', value='pending').stream()
-    pending_tasks = [{'id': d.id, **d.to_dict()} for d in p_tasks]
 
-    # Pending Withdraws
-    p_withdraws = db.collection('withdraw_requests').where(field_path='status', op_string='==', value='pending').stream()
-    pending_withdraws = [{'id': d.id, **d.to_dict()} for d in p_withdraws]
-
-    # Activation Requests
-    act_reqs = db.collection('activation_requests').where(field_path='status', op_string='==', value='pending').stream()
-    activation_requests = [{'id': d.id, **d.to_dict()} for d in act_reqs]
-
-    # Active Tasks (Limited to 20)
-    all_tasks_stream = db.collection('tasks').order_by('created_at', direction=Query.DESCENDING).limit(20).stream()
-    active_tasks = [{'id': d.id, **d.to_dict()} for d in all_tasks_stream]
-
-    return render_template('admin.html', 
-                           pending_tasks=pending_tasks, 
-                           pending_withdraws=pending_withdraws,
-                           activation_requests=activation_requests,
-                           active_tasks=active_tasks)
 @app.route('/notice', methods=['GET', 'POST'])
 @login_required
 def notice():
@@ -796,116 +1000,237 @@ def notice():
         message = request.form.get('message')
         
         if title and message:
-            db.collection('notices').add({
+            repos.notices.add({
                 'title': title,
                 'message': message,
                 'date': datetime.datetime.now()
             })
+            invalidate_notices()
             flash("নোটিশ সফলভাবে পোস্ট করা হয়েছে!", "success")
         return redirect(url_for('notice'))
 
-    # --- 2. GET NOTICES ---
-    notices_ref = db.collection('notices').order_by('date', direction=Query.DESCENDING).stream()
-    notices = [{'id': n.id, **n.to_dict()} for n in notices_ref]
-    
-    return render_template('notice.html', notices=notices)
+    # --- 2. GET NOTICES (প্রথম পেজ শেয়ার্ড ক্যাশ থেকে) ---
+    if notice_version.changed():
+        notice_page_cache.clear()
+
+    if session.get('_flashes'):
+        # ফ্ল্যাশ মেসেজ সহ পেজ ক্যাশ বা 304 করা যাবে না
+        notices, next_cursor = notice_page()
+        return render_template('notice.html', notices=notices, next_cursor=next_cursor)
+
+    variant = 'admin' if session.get('is_admin') else ('user' if session.get('user_id') else 'guest')
+    page = notice_page_cache.get(variant)
+    if page is None:
+        notices, next_cursor = notice_page()
+        html = render_template('notice.html', notices=notices, next_cursor=next_cursor)
+        page = (html, hashlib.sha1(html.encode()).hexdigest(), notices[0]['date'] if notices else None)
+        notice_page_cache.set(variant, page)
+
+    html, etag, last_modified = page
+    response = make_response(html)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # ব্রাউজার প্রতিবার যাচাই করবে, নতুন কিছু না থাকলে 304 পাবে
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+@app.route('/notices')
+def notice_list():
+    # নোটিশ পেজের "Load more" বাটনের জন্য পরের পেজ (JSON)
+    try:
+        page, next_cursor = notice_page(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+
+    return jsonify({
+        "status": "success",
+        "notices": [{
+            'id': n['id'],
+            'title': n.get('title', ''),
+            'message': n.get('message', ''),
+            'day': n['date'].strftime('%d'),
+            'month': n['date'].strftime('%b'),
+            'year': n['date'].strftime('%Y')
+        } for n in page],
+        "next_cursor": next_cursor
+    })
 @app.route(f'/{ADMIN_ROUTE}/approve_activation/<req_id>/<user_uid>')
 @admin_required
 def approve_activation(req_id, user_uid):
     # 1. User কে Active করা
-    db.collection('users').document(user_uid).update({'is_active': True})
+    repos.users.ref(user_uid).update({'is_active': True})
     
     # 2. Request status update
-    db.collection('activation_requests').document(req_id).update({'status': 'approved'})
+    repos.activations.ref(req_id).update({'status': 'approved'})
     
     flash("User Account Activated Successfully!", "success")
     return redirect(f'/{ADMIN_ROUTE}')
 @app.route(f'/{ADMIN_ROUTE}/approve_task/<submission_id>')
 @admin_required
 def approve_task(submission_id):
-    sub_ref = db.collection('task_submissions').document(submission_id)
-    sub = sub_ref.get().to_dict()
+    sub_ref = repos.submissions.ref(submission_id)
+    sub_doc = sub_ref.get()
+    sub = sub_doc.to_dict()
     
     if sub and sub['status'] == 'pending':
         # Get Task Info for Reward
-        task_info = db.collection('tasks').document(sub['task_id']).get().to_dict()
+        task_info = task_catalog.get(sub['task_id']) or {}
         reward = task_info.get('reward', 0)
         
-        # Update User Balance
-        user_ref = db.collection('users').document(sub['uid'])
-        user_data = user_ref.get().to_dict()
-        new_bal = user_data['balance'] + reward
-        user_ref.update({'balance': new_bal})
-        
-        # Update Submission
-        sub_ref.update({'status': 'approved'})
-        
-        # Log
-        db.collection('balance_history').add({
-            'uid': sub['uid'],
-            'type': 'task_earning',
-            'amount': reward,
-            'description': task_info['title'],
-            'timestamp': datetime.datetime.now()
-        })
-        
-        flash("Task Approved & Balance Added.", "success")
+        # Balance, Counters, Log & Submission একসাথে (অন্য অ্যাডমিন আগে অ্যাপ্রুভ করলে ফেল করবে)
+        batch = repos.batch()
+        ledger.post(repos, sub['uid'], reward, 'task_earning', task_info.get('title', 'Task'),
+                    writer=batch, user_fields=task_stats_delta('pending', 'approved'))
+        batch.update(sub_ref, {'status': 'approved'}, option=repos.write_option(last_update_time=sub_doc.update_time))
+        try:
+            batch.commit()
+            flash("Task Approved & Balance Added.", "success")
+        except (firestore.NotFound, firestore.FailedPrecondition):
+            flash("Task could not be approved (user missing or already processed).", "error")
     
     return redirect(url_for('admin_panel'))
 
 @app.route(f'/{ADMIN_ROUTE}/reject_task/<submission_id>')
 @admin_required
 def reject_task(submission_id):
-    db.collection('task_submissions').document(submission_id).update({'status': 'rejected'})
-    flash("Task Rejected.", "success")
+    sub_ref = repos.submissions.ref(submission_id)
+    sub_doc = sub_ref.get()
+    sub = sub_doc.to_dict()
+
+    # শুধু পেন্ডিং সাবমিশন রিজেক্ট হয় (অ্যাপ্রুভড হলে রিওয়ার্ড ফেরত নেওয়া হয় না)
+    if not sub or sub['status'] != 'pending':
+        flash("Task could not be rejected (already processed).", "error")
+        return redirect(url_for('admin_panel'))
+
+    # অন্য অ্যাডমিন একই সময়ে অ্যাপ্রুভ/রিজেক্ট করলে প্রিকন্ডিশন ফেল করবে, কাউন্টার দুবার সরবে না
+    precondition = repos.write_option(last_update_time=sub_doc.update_time)
+    batch = repos.batch()
+    batch.update(sub_ref, {'status': 'rejected'}, option=precondition)
+    batch.update(repos.users.ref(sub['uid']), task_stats_delta('pending', 'rejected'))
+    try:
+        try:
+            batch.commit()
+        except firestore.NotFound:
+            # ইউজার ডিলিট হয়ে গেলে শুধু সাবমিশন আপডেট
+            sub_ref.update({'status': 'rejected'}, option=precondition)
+        flash("Task Rejected.", "success")
+    except (firestore.NotFound, firestore.FailedPrecondition):
+        flash("Task could not be rejected (already processed).", "error")
     return redirect(url_for('admin_panel'))
 @app.route(f'/{ADMIN_ROUTE}/approve_withdraw/<req_id>')
 @admin_required
 def approve_withdraw(req_id):
     # ১. রিকোয়েস্ট ডাটা আনা
-    req_ref = db.collection('withdraw_requests').document(req_id)
-    req = req_ref.get().to_dict()
+    req_doc = repos.withdraws.get(req_id)
+    req = req_doc.to_dict()
     
     if req and req['status'] == 'pending':
-        # ২. স্ট্যাটাস আপডেট করা (Request Table)
-        req_ref.update({'status': 'paid'})
-        
-        # ৩. হিস্টোরি আপডেট করা (যাতে ড্যাশবোর্ডে Hold না দেখায়)
-        # ইউজারের ওই নির্দিষ্ট পরিমাণের 'Hold' এন্ট্রিটি খুঁজে বের করা
-        history_query = db.collection('balance_history')\
-            .where(field_path='uid', op_string='==', value=req['uid'])\
-            .where(field_path='amount', op_string='==', value=-req['amount'])\
-            .where(field_path='type', op_string='==', value='withdraw_hold')\
-            .limit(1).stream()
-            
-        for doc in history_query:
-            # Hold কে Paid এ পরিবর্তন করা
-            doc.reference.update({
-                'type': 'withdraw_paid',
-                'description': f"Paid via {req['method']} ({req['number']})"
-            })
-            
-        flash("Withdraw marked as PAID & History Updated.", "success")
+        # ২. স্ট্যাটাস আপডেট ও হিস্টোরির Hold এন্ট্রি Paid করা, একই ব্যাচে (hold_entry_id দিয়ে সরাসরি)
+        try:
+            ledger.settle_withdraw(repos, req_doc, paid=True)
+            flash("Withdraw marked as PAID & History Updated.", "success")
+        except (firestore.NotFound, firestore.FailedPrecondition):
+            flash("Withdraw could not be approved (already processed).", "error")
     
     return redirect(f'/{ADMIN_ROUTE}')
 @app.route(f'/{ADMIN_ROUTE}/reject_withdraw/<req_id>')
 @admin_required
 def reject_withdraw(req_id):
     # Refund Balance
-    req_ref = db.collection('withdraw_requests').document(req_id)
-    req = req_ref.get().to_dict()
+    req_doc = repos.withdraws.get(req_id)
+    req = req_doc.to_dict()
     
     if req and req['status'] == 'pending':
-        user_ref = db.collection('users').document(req['uid'])
-        user_data = user_ref.get().to_dict()
-        # Add the money back to user account
-        user_ref.update({'balance': user_data['balance'] + req['amount']})
-        
-        req_ref.update({'status': 'rejected'})
-        flash("Withdraw rejected & Refunded.", "success")
+        # Add the money back to user account (refund + status + hold entry in one commit)
+        try:
+            ledger.settle_withdraw(repos, req_doc, paid=False)
+            flash("Withdraw rejected & Refunded.", "success")
+        except (firestore.NotFound, firestore.FailedPrecondition):
+            flash("Withdraw could not be rejected (user missing or already processed).", "error")
         
     return redirect(url_for('admin_panel'))
 
+# --- METRICS (PROMETHEUS) ---
+@app.route(f'/{ADMIN_ROUTE}/metrics')
+def metrics_endpoint():
+    # অ্যাডমিন সেশন অথবা METRICS_TOKEN (স্ক্র্যাপারের জন্য)
+    token_ok = METRICS_TOKEN and request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}"
+    if not token_ok and not session.get('is_admin'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    body = metrics.registry.render() + metrics.render_summary(
+        'fanout_query_seconds', query_latency.summary(), 'Dashboard fan-out query latency.')
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+# --- DATA RETENTION (CRON + CLI) ---
+@app.route('/cron/retention')
+def cron_retention():
+    # শুধুমাত্র Vercel Cron (বা সঠিক সিক্রেট সহ কল) চালাতে পারবে
+    if not CRON_SECRET or request.headers.get('Authorization') != f"Bearer {CRON_SECRET}":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    deleted = run_retention(repos)
+    expired = expire_stale_uploads(repos) # হারিয়ে যাওয়া আপলোড 'failed' দেখাবে
+    return jsonify({"status": "success", "deleted": deleted, "expired_uploads": expired})
+
+@app.cli.command('retention')
+def retention_command():
+    """Delete old submissions, history and finished withdraws; fail stale uploads (`flask --app app retention`)."""
+    deleted = run_retention(repos)
+    print(f"Retention deleted: {deleted}")
+    print(f"Stale uploads marked failed: {expire_stale_uploads(repos)}")
+
+# --- REFERRAL COUNTER ROLLUP (CRON + CLI) ---
+@app.route('/cron/rollup_counters')
+def cron_rollup_counters():
+    if not CRON_SECRET or request.headers.get('Authorization') != f"Bearer {CRON_SECRET}":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    users = counters.rollup_all(repos)
+    return jsonify({"status": "success", "users": users})
+
+@app.cli.command('rollup-counters')
+def rollup_counters_command():
+    """Fold referral counter shards into users.balance / users.referral_count (`flask --app app rollup-counters`)."""
+    users = counters.rollup_all(repos)
+    print(f"Rolled up counter shards for {users} users.")
+
+# --- CLI: BACKFILL TASK COUNTERS ---
+@app.cli.command('backfill-task-stats')
+def backfill_task_stats():
+    """Rebuild users.task_stats and users.completed_task_ids from existing task_submissions.
+
+    Run once after deploying the counters (`flask --app app backfill-task-stats`),
+    ideally while no submissions are being approved.
+    """
+    counts = {}
+    completed = {}
+    for sub in repos.submissions.collection().select(['uid', 'status', 'task_id']).stream():
+        data = sub.to_dict()
+        if data.get('task_id'):
+            completed.setdefault(data.get('uid'), set()).add(data['task_id'])
+        if data.get('status') in TASK_STATUSES:
+            user_counts = counts.setdefault(data.get('uid'), dict.fromkeys(TASK_STATUSES, 0))
+            user_counts[data['status']] += 1
+
+    batch = repos.batch()
+    in_batch = 0
+    updated = 0
+    for user in repos.users.collection().select([]).stream():
+        changes = {'task_stats': counts.get(user.id, dict.fromkeys(TASK_STATUSES, 0))}
+        if user.id in completed:
+            changes['completed_task_ids'] = firestore.ArrayUnion(sorted(completed[user.id]))
+        batch.update(user.reference, changes)
+        in_batch += 1
+        updated += 1
+        if in_batch == 400:  # Firestore batch limit 500
+            batch.commit()
+            batch = repos.batch()
+            in_batch = 0
+    if in_batch:
+        batch.commit()
+    print(f"Backfilled task_stats and completed_task_ids for {updated} users.")
+
 # Required for Vercel
 app = app 
 
@@ -0,0 +1,95 @@
+import ledger
+import lazy_firestore as firestore
+
+APPROVAL_CHUNK = 100  # each submission costs 2 writes plus 1 per user; stays under the 500 limit
+GET_ALL_CHUNK = 300
+
+
+def _get_all(repos, refs):
+    for i in range(0, len(refs), GET_ALL_CHUNK):
+        yield from repos.get_all(refs[i:i + GET_ALL_CHUNK])
+
+
+def _approve_chunk(repos, chunk, tasks, existing_users, description):
+    """Queue and commit one atomic batch approving every snapshot in ``chunk``."""
+    batch = repos.batch()
+    per_user = {}
+
+    for snap in chunk:
+        sub = snap.to_dict()
+        task = tasks.get(sub.get('task_id')) or {}
+        reward = task.get('reward', 0)
+
+        batch.update(snap.reference, {'status': 'approved'},
+                     option=repos.write_option(last_update_time=snap.update_time))
+        ledger.record_entry(repos, batch, sub['uid'], reward, 'task_earning', description)
+        if sub['uid'] in existing_users:
+            total, count = per_user.get(sub['uid'], (0, 0))
+            per_user[sub['uid']] = (total + reward, count + 1)
+
+    for uid, (total, count) in per_user.items():
+        ledger.adjust_balance(repos, batch, uid, total, **{
+            'task_stats.pending': firestore.Increment(-count),
+            'task_stats.approved': firestore.Increment(count)
+        })
+
+    batch.commit()
+
+
+def bulk_approve(repos, task_catalog, submission_ids, description='Bulk Approved Task'):
+    """Approve many task submissions with a handful of RPCs.
+
+    1. Prefetch every submission and user with ``get_all`` (rewards come from
+       the task catalog cache).
+    2. Aggregate rewards and counter moves per user.
+    3. Commit in atomic batches of APPROVAL_CHUNK submissions. Each
+       submission update carries a ``last_update_time`` precondition, so a
+       submission changed concurrently (e.g. approved by another admin)
+       fails its chunk instead of paying twice. The chunk is then re-read,
+       submissions that are no longer pending are dropped, and the rest is
+       retried once.
+
+    Returns ``{submission_id: 'approved' | 'not_found' | 'not_pending' | 'failed'}``.
+    """
+    ids = list(dict.fromkeys(i for i in submission_ids if i and '/' not in i))
+    order = {sub_id: n for n, sub_id in enumerate(ids)}
+    results = {i: 'not_found' for i in ids}
+
+    def fetch_pending(sub_ids):
+        pending = []
+        for snap in _get_all(repos, [repos.submissions.ref(i) for i in sub_ids]):
+            if not snap.exists:
+                results[snap.id] = 'not_found'
+            elif snap.to_dict().get('status') != 'pending':
+                results[snap.id] = 'not_pending'
+            else:
+                pending.append(snap)
+        pending.sort(key=lambda snap: order[snap.id])
+        return pending
+
+    # --- Stage 1: prefetch ---
+    pending = fetch_pending(ids)
+    tasks = task_catalog.get_many([snap.to_dict().get('task_id') for snap in pending])
+    uids = list({snap.to_dict().get('uid') for snap in pending if snap.to_dict().get('uid')})
+    existing_users = {snap.id for snap in _get_all(repos, [repos.users.ref(u) for u in uids])
+                      if snap.exists}
+
+    # --- Stage 2 & 3: aggregate per user, commit in chunks ---
+    for start in range(0, len(pending), APPROVAL_CHUNK):
+        chunk = pending[start:start + APPROVAL_CHUNK]
+        try:
+            try:
+                _approve_chunk(repos, chunk, tasks, existing_users, description)
+            except firestore.FailedPrecondition:
+                # Changed since the prefetch: retry whatever is still pending.
+                chunk = fetch_pending([snap.id for snap in chunk])
+                if chunk:
+                    _approve_chunk(repos, chunk, tasks, existing_users, description)
+            outcome = 'approved'
+        except Exception as e:
+            print(f"Bulk Approve Error: {e}")
+            outcome = 'failed'
+        for snap in chunk:
+            results[snap.id] = outcome
+
+    return results
@@ -0,0 +1,279 @@
+"""Per-route Firestore read/write budget check.
+
+Drives every route (and every admin panel form) with the Flask test client against the instrumented
+in-memory datastore (DATASTORE=memory) and counts billed reads, writes,
+deletes and RPCs per request:
+
+    python bench_budgets.py             # check against budgets.json
+    python bench_budgets.py --update    # rewrite budgets.json from this run
+
+Each scenario is measured in steady state (its caches warmed by one
+identical request first) on a small and on a large dataset (more tasks,
+history rows, users and notices). The run fails when a route goes over its
+budget, or when a route marked ``scale_free`` costs more on the large
+dataset than on the small one, i.e. an O(1) page quietly became
+O(catalog) or O(history).
+"""
+import os
+import sys
+import json
+import argparse
+import datetime
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUDGETS_FILE = os.path.join(HERE, 'budgets.json')
+SIZES = {'small': 60, 'large': 600}  # small already fills every page size
+METRICS = ('reads', 'writes', 'deletes', 'rpcs')
+
+
+def seed(db, n):
+    now = datetime.datetime(2024, 6, 1)
+    users = db.collection('users')
+    users.document('u1').set({
+        'email': 'u1@bench.local', 'name': 'Bench User', 'balance': 1_000_000.0, 'role': 'user',
+        'is_banned': False, 'is_active': True, 'kyc_submitted': True, 'created_at': now,
+        'referral_count': n, 'referred_by': None,
+        'task_stats': {'approved': 0, 'pending': 0, 'rejected': 0}
+    })
+    users.document('adm').set({
+        'email': 'adm@bench.local', 'name': 'Admin', 'balance': 0.0, 'role': 'admin',
+        'is_banned': False, 'created_at': now, 'referral_count': 0
+    })
+    for i in range(n):
+        users.document(f'r{i:04d}').set({
+            'email': f'r{i}@bench.local', 'name': f'Referral {i}', 'balance': 0.0, 'role': 'user',
+            'is_banned': False, 'created_at': now - datetime.timedelta(minutes=i), 'referral_count': 0,
+            'referred_by': 'u1', 'task_stats': {'approved': 0, 'pending': 0, 'rejected': 0}
+        })
+        db.collection('tasks').document(f't{i:04d}').set({
+            'title': f'Task {i}', 'reward': 5.0, 'task_link': '', 'proof_requirement': 'text',
+            'created_at': now - datetime.timedelta(minutes=i)
+        })
+        db.collection('balance_history').add({
+            'uid': 'u1', 'type': 'task_earning', 'amount': 5.0, 'description': f'Task {i}',
+            'timestamp': now - datetime.timedelta(minutes=i)
+        })
+        db.collection('notices').add({
+            'title': f'Notice {i}', 'message': 'Hello', 'date': now - datetime.timedelta(minutes=i)
+        })
+    db.collection('settings').document('system_notice').set({'text': 'Welcome', 'link': '', 'updated_at': now})
+
+    # Same queue sizes at every scale; only the catalogs grow.
+    for i in range(5):
+        db.collection('task_submissions').document(f'r{i:04d}_t{i:04d}').set({
+            'uid': f'r{i:04d}', 'task_id': f't{i:04d}', 'status': 'pending', 'proof': 'x', 'timestamp': now
+        })
+    for i in range(3):
+        db.collection('withdraw_requests').add({
+            'uid': f'r{i:04d}', 'amount': 250.0, 'status': 'pending', 'method': 'bkash', 'number': '1', 'timestamp': now
+        })
+        db.collection('activation_requests').add({
+            'uid': f'r{i:04d}', 'status': 'pending', 'method': 'bkash', 'trx_id': 'x', 'timestamp': now
+        })
+
+
+def scenarios(appmod, db):
+    """``{name: prepare}``; ``prepare()`` sets up (uncounted) and returns ``(login, method, path, kwargs, status)``.
+
+    ``status`` is the HTTP status the scenario must produce, so a request
+    that bounces to /auth or errors out cannot pass at near-zero cost.
+    """
+    import ledger
+    counter = iter(range(10 ** 9))
+    user, admin, guest = ('u1', False), ('adm', True), None
+
+    def new_task():
+        task_id = f'bench-task-{next(counter)}'
+        db.collection('tasks').document(task_id).set({
+            'title': 'Bench', 'reward': 5.0, 'created_at': datetime.datetime(2024, 1, 1)
+        })
+        return task_id
+
+    def new_submission():
+        task_id = new_task()
+        sub_id = appmod.submission_id('u1', task_id)
+        db.collection('task_submissions').document(sub_id).set({
+            'uid': 'u1', 'task_id': task_id, 'status': 'pending', 'proof': 'x',
+            'timestamp': datetime.datetime(2024, 1, 1)
+        })
+        return sub_id
+
+    def new_withdraw():
+        return ledger.hold_for_withdraw(appmod.repos, 'u1', 250.0, {'method': 'bkash', 'number': '1', 'email': 'u1@bench.local'}).id
+
+    def new_activation():
+        _, ref = db.collection('activation_requests').add({'uid': 'u1', 'status': 'pending'})
+        return ref.id
+
+    def deep_users_page():
+        last = list(db.collection('users').order_by('created_at').limit(25).stream())[-1]
+        return appmod.encode_page_token({'id': last.id, **last.to_dict()}, 40)
+
+    def dashboard_etag():
+        page = appmod.dashboard_cache.get('u1')
+        return page[0] if page else ''
+
+    def uncached_dashboard():
+        appmod.dashboard_cache.clear()  # as after a write to users/u1
+        return user, 'GET', '/dashboard', {}, 200
+
+    def notice_cursor():
+        return appmod.notice_page()[1] or ''
+
+    def new_user():
+        uid = f'bench-user-{next(counter)}'
+        db.collection('users').document(uid).set({
+            'email': f'{uid}@bench.local', 'name': 'Bench', 'balance': 0.0, 'role': 'user',
+            'is_banned': False, 'created_at': datetime.datetime(2024, 1, 1), 'referral_count': 0
+        })
+        return uid
+
+    admin_path = f'/{appmod.ADMIN_ROUTE}'
+    cron = {'headers': {'Authorization': f'Bearer {appmod.CRON_SECRET}'}}
+    task_form = {'create_task': '1', 'title': 'Bench', 'category': 'other', 'task_link': '',
+                 'description': 'd', 'reward': '5', 'proof_requirement': 'link'}
+
+    return {
+        'index': lambda: (guest, 'GET', '/', {}, 200),
+        'session_login_existing': lambda: (guest, 'POST', '/session_login', {'json': {'idToken': 'u1'}}, 200),
+        'session_login_signup_referral': lambda: (guest, 'POST', '/session_login', {
+            'json': {'idToken': f'new-{next(counter)}', 'refCode': 'u1', 'name': 'New'}}, 200),
+        'dashboard': lambda: (user, 'GET', '/dashboard', {}, 200),
+        'dashboard_uncached': uncached_dashboard,
+        'dashboard_revalidate': lambda: (user, 'GET', '/dashboard', {
+            'headers': {'If-None-Match': f'"{dashboard_etag()}"'}}, 304),
+        'referrals_more': lambda: (user, 'GET', '/referrals', {}, 200),
+        'kyc_form': lambda: (('r0002', False), 'GET', '/kyc', {}, 200),
+        'submit_kyc': lambda: (('r0003', False), 'POST', '/submit_kyc', {
+            'data': {'name': 'R', 'address': 'A', 'phone': '1', 'dob': '2000-01-01', 'education': 'E'}}, 302),
+        'tasks': lambda: (user, 'GET', '/tasks', {}, 200),
+        'tasks_submit': lambda: (user, 'POST', '/tasks', {'data': {'task_id': new_task(), 'proof_text': 'done'}}, 302),
+        'withdraw': lambda: (user, 'GET', '/withdraw', {}, 200),
+        'withdraw_submit': lambda: (user, 'POST', '/withdraw', {
+            'data': {'amount': '250', 'method': 'bkash', 'number': '1'}}, 302),
+        'notice': lambda: (user, 'GET', '/notice', {}, 200),
+        'notice_post': lambda: (admin, 'POST', '/notice', {'data': {'title': 'Bench', 'message': 'Hello'}}, 302),
+        'notices_more': lambda: (user, 'GET', f'/notices?cursor={notice_cursor()}', {}, 200),
+        'submit_activation': lambda: (user, 'POST', '/submit_activation', {
+            'data': {'method': 'bkash', 'sender_number': '1', 'trx_id': 'x'}}, 302),
+        'admin_panel': lambda: (admin, 'GET', admin_path, {}, 200),
+        'admin_create_task': lambda: (admin, 'POST', admin_path, {'data': task_form}, 200),
+        'admin_update_balance': lambda: (admin, 'POST', admin_path, {
+            'data': {'update_balance': '1', 'target_uid': 'r0004', 'amount': '5', 'action_type': 'add'}}, 200),
+        'admin_publish_notice': lambda: (admin, 'POST', admin_path, {
+            'data': {'publish_notice': '1', 'title': 'Bench', 'message': 'Hello'}}, 200),
+        'admin_update_system_notice': lambda: (admin, 'POST', admin_path, {
+            'data': {'update_system_notice': '1', 'notice_text': 'Welcome', 'notice_link': ''}}, 200),
+        'manage_users': lambda: (admin, 'GET', f'{admin_path}/ui', {}, 200),
+        'manage_users_deep_page': lambda: (admin, 'GET', f'{admin_path}/ui?after={deep_users_page()}', {}, 200),
+        'ban_user': lambda: (admin, 'GET', f'{admin_path}/ban_user/r0001', {}, 302),
+        'unban_user': lambda: (admin, 'GET', f'{admin_path}/unban_user/r0001', {}, 302),
+        'delete_user': lambda: (admin, 'GET', f'{admin_path}/delete_user/{new_user()}', {}, 302),
+        'approve_task': lambda: (admin, 'GET', f'{admin_path}/approve_task/{new_submission()}', {}, 302),
+        'reject_task': lambda: (admin, 'GET', f'{admin_path}/reject_task/{new_submission()}', {}, 302),
+        'bulk_approve_20': lambda: (admin, 'POST', f'{admin_path}/bulk_approve', {
+            'data': {'selected_ids': [new_submission() for _ in range(20)]}}, 302),
+        'approve_withdraw': lambda: (admin, 'GET', f'{admin_path}/approve_withdraw/{new_withdraw()}', {}, 302),
+        'reject_withdraw': lambda: (admin, 'GET', f'{admin_path}/reject_withdraw/{new_withdraw()}', {}, 302),
+        'approve_activation': lambda: (admin, 'GET', f'{admin_path}/approve_activation/{new_activation()}/u1', {}, 302),
+        # Last: retention deletes the seeded (old) history the scenarios above read.
+        'cron_rollup_counters': lambda: (guest, 'GET', '/cron/rollup_counters', cron, 200),
+        'cron_retention': lambda: (guest, 'GET', '/cron/retention', cron, 200),
+    }
+
+
+def measure(size):
+    """Run every scenario on a fresh process-local datastore; returns ``{name: stats}``."""
+    os.environ['DATASTORE'] = 'memory'
+    os.environ['CRON_SECRET'] = 'bench-cron'
+    sys.path.insert(0, HERE)
+    import app as appmod
+    from firebase_admin import auth as admin_auth
+
+    db = appmod.db
+    # Synthetic sign-ins: the id token is the uid. The Firebase app itself is
+    # initialized for real (offline, with a throwaway service account).
+    from bench_startup import throwaway_credentials
+    os.environ.setdefault('FIREBASE_CREDENTIALS_JSON', throwaway_credentials())
+    admin_auth.verify_id_token = lambda token: {'uid': token, 'email': f'{token}@bench.local'}
+    appmod.notifier.sender = lambda text, timeout=None: None  # no Telegram traffic from a benchmark
+    seed(db, SIZES[size])
+
+    client = appmod.app.test_client()
+    results = {}
+    for name, prepare in scenarios(appmod, db).items():
+        for attempt in range(2):  # first run warms caches, second is measured
+            login, method, path, kwargs, expected = prepare()
+            with client.session_transaction() as sess:
+                sess.clear()
+                if login:
+                    sess['user_id'], sess['is_admin'] = login
+                    sess['email'] = f'{login[0]}@bench.local'
+            db.reset_stats()
+            response = client.open(path, method=method, **kwargs)
+            stats = db.stats()
+        location = response.headers.get('Location', '')
+        if response.status_code != expected or location.endswith('/auth'):
+            raise SystemExit(f"{name}: HTTP {response.status_code} {location} (expected {expected})")
+        results[name] = stats
+    appmod.upload_pipeline.join()
+    appmod.notifier.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--update', action='store_true', help="write this run's numbers to budgets.json")
+    parser.add_argument('--measure', choices=SIZES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        return
+
+    # One process per size so no cache or datastore state leaks between runs.
+    runs = {}
+    for size in SIZES:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', size],
+                             capture_output=True, text=True, cwd=HERE)
+        if out.returncode:
+            sys.exit(f"Measuring '{size}' failed:\n{out.stdout}{out.stderr}")
+        runs[size] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    small, large = runs['small'], runs['large']
+    if args.update:
+        budgets = {name: {**large[name], 'scale_free': small[name] == large[name]} for name in large}
+        with open(BUDGETS_FILE, 'w') as f:
+            json.dump(budgets, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"Wrote {len(budgets)} budgets to {BUDGETS_FILE}")
+        return
+
+    with open(BUDGETS_FILE) as f:
+        budgets = json.load(f)
+
+    failures = []
+    print(f"{'route':<32}" + ''.join(f"{m:>9}" for m in METRICS) + "  (large dataset; budget in brackets)")
+    for name in sorted(large):
+        budget = budgets.get(name)
+        row = f"{name:<32}" + ''.join(
+            f"{large[name][m]:>4} [{budget[m]:>2}]" if budget else f"{large[name][m]:>9}" for m in METRICS)
+        print(row)
+        if budget is None:
+            failures.append(f"{name}: no budget in budgets.json")
+            continue
+        for m in METRICS:
+            if large[name][m] > budget[m]:
+                failures.append(f"{name}: {m} {large[name][m]} > budget {budget[m]}")
+        if budget.get('scale_free') and large[name] != small[name]:
+            failures.append(f"{name}: cost grows with data size ({small[name]} -> {large[name]})")
+
+    if failures:
+        print("\nBUDGET EXCEEDED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nAll routes within budget.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Referral signup load test against the local Firestore emulator.
+
+Simulates a burst of signups that all use the same referral code and
+measures throughput with and without counter shards:
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python bench_referrals.py --signups 500 --workers 50
+
+Each signup reads and commits exactly what ``session_login`` does (one
+``get_all`` for the user and referrer, then ``ledger.register_user``: new
+user, signup bonus entry and referral credit in one commit). Unsharded,
+every commit increments the same referrer document and contends on it;
+sharded, throughput should stay flat as the burst grows. The script checks
+that the referrer ends up with the right balance and referral count after a
+rollup, and reports the median commit latency (one round trip).
+
+A second phase fires several concurrent logins for each of a set of new
+uids, as a double-clicked sign-in button would. Exactly one signup per uid
+may succeed; the referrer must be credited once per uid.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import datetime
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import AlreadyExists
+from google.cloud import firestore
+
+import counters
+import ledger
+from repositories import Repositories
+
+
+def signup(repos, referrer_uid, uid=None):
+    """One ``session_login`` signup; returns the commit latency in seconds."""
+    uid = uid or f"bench-{uuid.uuid4().hex[:12]}"
+    docs = {doc.id: doc for doc in repos.users.get_many([uid, referrer_uid])}
+    if docs[uid].exists:
+        return None
+    t0 = time.perf_counter()
+    ledger.register_user(repos, repos.users.ref(uid), {
+        'email': f'{uid}@bench.local',
+        'name': uid,
+        'balance': 0.0,
+        'role': 'user',
+        'is_banned': False,
+        'is_active': False,
+        'created_at': datetime.datetime.now(),
+        'referral_count': 0,
+        'referred_by': None
+    }, docs[referrer_uid])
+    return time.perf_counter() - t0
+
+
+def new_referrer(repos):
+    referrer_uid = f"bench-referrer-{uuid.uuid4().hex[:8]}"
+    repos.users.ref(referrer_uid).set({'name': 'Referrer', 'balance': 0.0, 'referral_count': 0})
+    return referrer_uid
+
+
+def check_referrer(repos, referrer_uid, expected):
+    counters.rollup(repos, referrer_uid)
+    referrer = repos.users.get(referrer_uid).to_dict()
+    consistent = (referrer['referral_count'] == expected and referrer['balance'] == expected * ledger.REFERRAL_BONUS)
+    return referrer, consistent
+
+
+def run(repos, shards, signups, workers):
+    counters.REFERRAL_SHARDS = shards
+    referrer_uid = new_referrer(repos)
+
+    errors = 0
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(signup, repos, referrer_uid) for _ in range(signups)]:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"Signup Error: {e}")
+    elapsed = time.perf_counter() - start
+
+    ok = signups - errors
+    referrer, consistent = check_referrer(repos, referrer_uid, ok)
+    commit_ms = statistics.median(latencies) * 1000 if latencies else 0.0
+    print(f"shards={shards:<3} signups={ok}/{signups} time={elapsed:.2f}s "
+          f"throughput={ok / elapsed:.1f}/s commit_p50={commit_ms:.1f}ms referral_count={referrer['referral_count']} "
+          f"balance={referrer['balance']} {'OK' if consistent else 'MISMATCH'}")
+    return consistent
+
+
+def run_duplicates(repos, users, attempts):
+    """Race ``attempts`` concurrent signups per uid; each uid must be credited once."""
+    counters.REFERRAL_SHARDS = 0
+    referrer_uid = new_referrer(repos)
+    uids = [f"bench-dup-{uuid.uuid4().hex[:12]}" for _ in range(users)]
+
+    created = errors = 0
+    with ThreadPoolExecutor(max_workers=users * attempts) as pool:
+        futures = [pool.submit(signup, repos, referrer_uid, uid) for uid in uids for _ in range(attempts)]
+        for future in futures:
+            try:
+                created += future.result() is not None
+            except AlreadyExists:
+                pass  # lost the race: another login created this user first
+            except Exception as e:
+                errors += 1
+                print(f"Signup Error: {e}")
+
+    referrer, consistent = check_referrer(repos, referrer_uid, users)
+    bonuses = sum(1 for uid in uids for _ in repos.ledger.where('uid', '==', uid).stream())
+    consistent = consistent and created == users and bonuses == users and not errors
+    print(f"duplicates: {users} users x {attempts} concurrent logins -> created={created} "
+          f"lost_race={users * attempts - created - errors} errors={errors} "
+          f"signup_bonuses={bonuses} referral_count={referrer['referral_count']} "
+          f"{'OK' if consistent else 'DOUBLE CREDIT'}")
+    return consistent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--signups', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=30)
+    parser.add_argument('--shards', type=int, nargs='+', default=[0, 10])
+    parser.add_argument('--duplicate-users', type=int, default=20)
+    parser.add_argument('--duplicate-attempts', type=int, default=5)
+    parser.add_argument('--project', default='demo-bench')
+    args = parser.parse_args()
+
+    if not os.getenv('FIRESTORE_EMULATOR_HOST'):
+        sys.exit("FIRESTORE_EMULATOR_HOST is not set; refusing to load-test a real project.")
+
+    repos = Repositories(firestore.Client(project=args.project))
+    results = [run(repos, shards, args.signups, args.workers) for shards in args.shards]
+    results.append(run_duplicates(repos, args.duplicate_users, args.duplicate_attempts))
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
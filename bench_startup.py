@@ -0,0 +1,126 @@
+"""Cold-start benchmark: import time and first-request latency.
+
+Each run starts a fresh interpreter (like a new serverless instance),
+imports the app and serves one static page, one datastore page and a
+``/session_login`` POST with the Flask test client, against the in-memory
+datastore:
+
+    python bench_startup.py            # median of 5 cold starts
+    python bench_startup.py --runs 20
+
+It also lists which heavy libraries were already loaded after the import
+and after the static page; none should be, since ``/`` and ``/tutorial``
+never talk to Firestore, Firebase Auth or imgbb/Telegram.
+
+The login step is not patched: it posts a malformed ID token and requires
+the 401 to come from token verification, i.e. session_login initialized the
+Firebase app itself even though nothing had touched ``db`` yet. Unless
+FIREBASE_CREDENTIALS_JSON is set, a throwaway service account is generated
+(nothing is sent anywhere; the bad token is rejected locally).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ('google.cloud.firestore', 'google.api_core', 'firebase_admin', 'requests', 'grpc')
+STEPS = ('import', 'first_static', 'second_static', 'first_datastore', 'first_login')
+
+
+def loaded_heavy():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def throwaway_credentials():
+    """A syntactically valid service account JSON with a fresh key, for offline runs."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    return json.dumps({
+        'type': 'service_account',
+        'project_id': 'demo-bench',
+        'private_key_id': 'bench',
+        'private_key': pem,
+        'client_email': 'bench@demo-bench.iam.gserviceaccount.com',
+        'client_id': '0',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    })
+
+
+def measure(static_path, datastore_path):
+    """One cold start in this process; returns ``{step: ms, ...}``."""
+    import time
+    os.environ['DATASTORE'] = 'memory'
+    sys.path.insert(0, HERE)
+
+    t0 = time.perf_counter()
+    import app as appmod
+    timings = {'import': time.perf_counter() - t0}
+    heavy = {'import': loaded_heavy()}
+
+    client = appmod.app.test_client()
+    for step, path in (('first_static', static_path), ('second_static', static_path),
+                       ('first_datastore', datastore_path)):
+        t0 = time.perf_counter()
+        response = client.get(path)
+        timings[step] = time.perf_counter() - t0
+        if response.status_code >= 500:
+            raise SystemExit(f"GET {path}: HTTP {response.status_code}")
+        heavy.setdefault(step, loaded_heavy())
+
+    t0 = time.perf_counter()
+    response = client.post('/session_login', json={'idToken': 'bench-malformed-token'})
+    timings['first_login'] = time.perf_counter() - t0
+    message = (response.get_json(silent=True) or {}).get('message', '')
+    if response.status_code != 401 or 'does not exist' in message:
+        raise SystemExit(f"POST /session_login: HTTP {response.status_code} {message}")
+    heavy['first_login'] = loaded_heavy()
+
+    return {'ms': {step: seconds * 1000 for step, seconds in timings.items()}, 'heavy': heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--static', default='/', help='page that must not touch the datastore')
+    parser.add_argument('--datastore', default='/notices', help='page that reads from the datastore')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.static, args.datastore)))
+        return
+
+    env = dict(os.environ)
+    env.setdefault('FIREBASE_CREDENTIALS_JSON', throwaway_credentials())
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure',
+                              '--static', args.static, '--datastore', args.datastore],
+                             capture_output=True, text=True, cwd=HERE, env=env)
+        if out.returncode:
+            sys.exit(f"Cold start failed:\n{out.stdout}{out.stderr}")
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'step':<18}{'median ms':>10}{'min ms':>10}{'max ms':>10}  ({args.runs} cold starts)")
+    for step in STEPS:
+        samples = [run['ms'][step] for run in runs]
+        print(f"{step:<18}{statistics.median(samples):>10.1f}{min(samples):>10.1f}{max(samples):>10.1f}")
+    total = statistics.median(run['ms']['import'] + run['ms']['first_static'] for run in runs)
+    print(f"\nCold start to first static page ({args.static}): {total:.1f} ms")
+
+    heavy = runs[-1]['heavy']
+    for step in STEPS:
+        print(f"Heavy modules loaded after {step}: {', '.join(heavy[step]) or 'none'}")
+    if heavy['first_static']:
+        sys.exit(f"\n{args.static} pulled in heavy imports: {', '.join(heavy['first_static'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import time
+import threading
+from collections import OrderedDict
+
+import lazy_firestore as firestore
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class VersionStamp:
+    """Counter document that lets every instance notice a remote invalidation.
+
+    Writers call ``bump()``; readers call ``changed()``, which reads the
+    document at most once per ``staleness`` seconds and reports whether the
+    version moved since the previous look.
+    """
+
+    def __init__(self, repos, name, staleness=30):
+        self.repos = repos
+        self.name = name
+        self.staleness = staleness
+        self._seen = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _ref(self):
+        return self.repos.cache_versions.ref(self.name)
+
+    def changed(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.staleness:
+                return False
+            self._checked_at = now
+        try:
+            doc = self._ref().get(['version'])
+            version = doc.to_dict().get('version', 0) if doc.exists else 0
+        except Exception as e:
+            print(f"Version Check Error ({self.name}): {e}")
+            return False
+        with self._lock:
+            previous, self._seen = self._seen, version
+        return previous is not None and previous != version
+
+    def bump(self):
+        self._ref().set({'version': firestore.Increment(1), 'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
@@ -0,0 +1,72 @@
+import os
+import random
+
+import lazy_firestore as firestore
+
+# Number of shards a hot user's referral credits are spread over; 0 keeps
+# writing straight to users/{uid}.
+REFERRAL_SHARDS = int(os.getenv("REFERRAL_SHARDS", 0))
+SHARDED_FIELDS = ('balance', 'referral_count')
+
+
+def increment(repos, writer, uid, num_shards=None, **amounts):
+    """Queue ``amounts`` (e.g. balance=10, referral_count=1) on one random shard of ``uid``."""
+    num_shards = num_shards or REFERRAL_SHARDS or 1
+    ref = repos.counter_shards.for_user(uid).document(str(random.randrange(num_shards)))
+    writer.set(ref, {field: firestore.Increment(value) for field, value in amounts.items()}, merge=True)
+
+
+def shard_totals(repos, uid, transaction=None):
+    """Sum the not-yet-rolled-up shards of ``uid``. Returns ``(totals, shard_snapshots)``."""
+    totals = dict.fromkeys(SHARDED_FIELDS, 0)
+    snaps = list(repos.counter_shards.for_user(uid).stream(transaction=transaction))
+    for snap in snaps:
+        data = snap.to_dict()
+        for field in SHARDED_FIELDS:
+            totals[field] += data.get(field, 0)
+    return totals, snaps
+
+
+def with_shard_totals(repos, uid, user):
+    """Return ``user`` (a dict) with pending shard credits added, for users that have shards."""
+    if not user or not user.get('sharded_counters'):
+        return user
+    totals, _ = shard_totals(repos, uid)
+    return {**user, **{field: user.get(field, 0) + totals[field] for field in SHARDED_FIELDS}}
+
+
+def fold_into(repos, transaction, uid):
+    """Inside ``transaction``: delete ``uid``'s shards and return their totals.
+
+    The caller adds the totals to the user document in the same transaction.
+    """
+    totals, snaps = shard_totals(repos, uid, transaction=transaction)
+    for snap in snaps:
+        transaction.delete(snap.reference)
+    return totals
+
+
+def rollup(repos, uid):
+    """Fold ``uid``'s shards into users/{uid} atomically."""
+    user_ref = repos.users.ref(uid)
+
+    @firestore.transactional
+    def run(transaction):
+        totals = fold_into(repos, transaction, uid)
+        if any(totals.values()):
+            transaction.update(user_ref, {field: firestore.Increment(value) for field, value in totals.items()})
+        return totals
+
+    return run(repos.transaction())
+
+
+def rollup_all(repos):
+    """Fold every user's shards. Returns the number of users rolled up."""
+    uids = {snap.reference.parent.parent.id
+            for snap in repos.counter_shards.all_users().select([]).stream()}
+    for uid in uids:
+        try:
+            rollup(repos, uid)
+        except Exception as e:
+            print(f"Rollup Error ({uid}): {e}")
+    return len(uids)
@@ -0,0 +1,93 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", 16))
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", 5))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+
+
+class LatencyRecorder:
+    """Keeps the most recent latency samples per query name."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name, q):
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self):
+        with self._lock:
+            names = list(self._samples)
+        return {name: {'count': len(self._samples[name]),
+                       'p50': self.percentile(name, 50),
+                       'p99': self.percentile(name, 99)} for name in names}
+
+
+query_latency = LatencyRecorder()
+
+
+class FanOutResults(dict):
+    """Query results by name; ``fell_back`` holds the names that got their default."""
+
+    def __init__(self):
+        super().__init__()
+        self.fell_back = set()
+
+
+def fan_out(queries, prefix='', timeouts=None, defaults=None):
+    """Run independent reads concurrently and gather their results.
+
+    ``queries`` maps a name to a zero-argument callable. Each query gets its
+    own timeout (``timeouts[name]`` or FANOUT_TIMEOUT, counted from the
+    moment the batch starts); a query that fails or times out yields
+    ``defaults[name]`` instead of failing the whole page, and its name is
+    added to the result's ``fell_back`` set so callers can avoid caching a
+    degraded page. Latencies are recorded in ``query_latency`` under
+    ``prefix + name``.
+    """
+    timeouts = timeouts or {}
+    defaults = defaults or {}
+    started = time.monotonic()
+
+    def timed(name, fn):
+        t0 = time.monotonic()
+        try:
+            return fn()
+        finally:
+            query_latency.record(prefix + name, time.monotonic() - t0)
+
+    # Each query runs in a copy of the caller's context, so per-request state
+    # (e.g. metrics.RequestStats) follows it into the worker thread.
+    futures = {name: _executor.submit(contextvars.copy_context().run, timed, name, fn)
+               for name, fn in queries.items()}
+
+    results = FanOutResults()
+    for name, future in futures.items():
+        remaining = timeouts.get(name, FANOUT_TIMEOUT) - (time.monotonic() - started)
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+        except TimeoutError:
+            print(f"Query Timeout: {prefix}{name}")
+            results[name] = defaults.get(name)
+            results.fell_back.add(name)
+        except Exception as e:
+            print(f"Query Error ({prefix}{name}): {e}")
+            results[name] = defaults.get(name)
+            results.fell_back.add(name)
+    return results
@@ -1,23 +1,96 @@
 import os
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
 
-def initialize_firebase():
-    # On Render, we paste the entire Service Account JSON into an ENV variable
-    # named FIREBASE_CREDENTIALS_JSON
-    cred_json = os.environ.get('FIREBASE_CREDENTIALS_JSON')
+# "firestore" (default) or "memory" for local runs and benchmarks without credentials
+DATASTORE = os.environ.get('DATASTORE', 'firestore')
+
+_firebase_lock = threading.Lock()
+
+def ensure_firebase_app():
+    """Initialize the default Firebase app (once) and return it.
+
+    The datastore client is built lazily, so code that needs Firebase before
+    touching ``db`` (e.g. ``auth.verify_id_token`` in session_login) must
+    call this first. Works with either DATASTORE backend.
+    """
+    # firebase_admin/google-cloud-firestore are heavy imports; load them only
+    # when they are actually needed
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _firebase_lock:
+        if firebase_admin._apps:
+            return firebase_admin.get_app()
 
-    if cred_json:
-        cred_dict = json.loads(cred_json)
-        cred = credentials.Certificate(cred_dict)
-    else:
-        # Fallback for local dev if you have the file
-        cred = credentials.Certificate("serviceAccountKey.json")
+        # On Render, we paste the entire Service Account JSON into an ENV variable
+        # named FIREBASE_CREDENTIALS_JSON
+        cred_json = os.environ.get('FIREBASE_CREDENTIALS_JSON')
 
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(cred)
+        if cred_json:
+            cred_dict = json.loads(cred_json)
+            cred = credentials.Certificate(cred_dict)
+        else:
+            # Fallback for local dev if you have the file
+            cred = credentials.Certificate("serviceAccountKey.json")
 
+        return firebase_admin.initialize_app(cred)
+
+def initialize_firebase():
+    from firebase_admin import firestore
+
+    ensure_firebase_app()
     return firestore.client()
 
-db = initialize_firebase()
+def initialize_datastore():
+    if DATASTORE == 'memory':
+        # In-memory Firestore stand-in: same API, nothing persisted
+        from memory_store import MemoryClient
+        return MemoryClient()
+    return initialize_firebase()
+
+
+class LazyClient:
+    """Stands in for the datastore client and builds it on first use.
+
+    Importing the app stays cheap on a cold start: credentials are parsed
+    and the client created only when a request first touches ``db``.
+    Construction happens once even when several threads race for it.
+    ``when_ready(fn)`` runs ``fn(client)`` right after construction (or
+    immediately if the client already exists), e.g. to instrument it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._client is not None
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._factory()
+                    for hook in self._hooks:
+                        hook(client)
+                    self._client = client
+                client = self._client
+        return client
+
+    def when_ready(self, fn):
+        with self._lock:
+            if self._client is None:
+                self._hooks.append(fn)
+                return
+        fn(self._client)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+db = LazyClient(initialize_datastore)
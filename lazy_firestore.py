@@ -0,0 +1,25 @@
+"""google-cloud-firestore names, imported on first use.
+
+``google.cloud.firestore`` and ``google.api_core`` take longer to import
+than the rest of the app together, and pages like ``/`` or ``/tutorial``
+never need them. Modules do ``import lazy_firestore as firestore`` and
+look names up at call time (``firestore.Increment(1)``,
+``except firestore.NotFound``), so a cold start only pays for the library
+on the first request that actually talks to the datastore.
+"""
+import importlib
+
+_SOURCES = {
+    'google.cloud.firestore': ('Increment', 'ArrayUnion', 'SERVER_TIMESTAMP', 'transactional'),
+    'google.api_core.exceptions': ('NotFound', 'AlreadyExists', 'FailedPrecondition'),
+}
+_MODULES = {name: module for module, names in _SOURCES.items() for name in names}
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value  # later lookups skip this hook
+    return value
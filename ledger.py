@@ -0,0 +1,195 @@
+import datetime
+
+import counters
+import lazy_firestore as firestore
+
+REFERRAL_BONUS = 10.0
+SIGNUP_BONUS = 10.0
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+def record_entry(repos, writer, uid, amount, entry_type, description=None, **fields):
+    """Queue a balance_history row on ``writer`` (batch or transaction) and return its reference."""
+    entry = {
+        'uid': uid,
+        'type': entry_type,
+        'amount': amount,
+        'timestamp': datetime.datetime.now(),
+        **fields
+    }
+    if description is not None:
+        entry['description'] = description
+    ref = repos.ledger.ref()
+    writer.set(ref, entry)
+    return ref
+
+
+def adjust_balance(repos, writer, uid, amount, **user_fields):
+    """Queue a server-side balance increment (plus any extra user fields) on ``writer``."""
+    writer.update(repos.users.ref(uid), {'balance': firestore.Increment(amount), **user_fields})
+
+
+def touch_user(repos, writer, uid):
+    """Queue a write that moves ``users/{uid}``'s update_time without changing money fields.
+
+    Cached dashboards are keyed on the user document's update_time, so a
+    ledger change that does not otherwise write the user (e.g. a paid
+    withdraw rewriting its hold entry) calls this in the same commit.
+    """
+    writer.update(repos.users.ref(uid), {'ledger_updated_at': firestore.SERVER_TIMESTAMP})
+
+
+def post(repos, uid, amount, entry_type, description=None, writer=None, user_fields=None, **fields):
+    """Move ``amount`` in or out of ``uid``'s balance and log it in the same commit.
+
+    Every money path goes through here (or ``hold_for_withdraw`` /
+    ``credit_referral``): the
+    balance changes with ``Increment`` so there is no read-modify-write race
+    and no read at all. Pass ``writer`` to join an existing batch or
+    transaction; otherwise a batch is created and committed here. Returns
+    the ledger entry reference.
+    """
+    own_batch = writer is None
+    if own_batch:
+        writer = repos.batch()
+    adjust_balance(repos, writer, uid, amount, **(user_fields or {}))
+    ref = record_entry(repos, writer, uid, amount, entry_type, description, **fields)
+    if own_batch:
+        writer.commit()
+    return ref
+
+
+def credit_referral(repos, writer, referrer_doc, new_user_name):
+    """Pay REFERRAL_BONUS to the referrer and count the referral on ``writer``.
+
+    ``referrer_doc`` is the referrer's snapshot (at least ``sharded_counters``
+    selected). With ``counters.REFERRAL_SHARDS`` set, the increments land on
+    a random counter shard instead of ``users/{uid}``, so a popular referrer
+    does not become a single-document write hotspot during signup bursts.
+    Readers add the shards back with ``counters.with_shard_totals``.
+    """
+    uid = referrer_doc.id
+    description = f'Referral Bonus: {new_user_name}'
+    if not counters.REFERRAL_SHARDS:
+        return post(repos, uid, REFERRAL_BONUS, 'referral_bonus', description,
+                    writer=writer, user_fields={'referral_count': firestore.Increment(1)})
+
+    if not (referrer_doc.to_dict() or {}).get('sharded_counters'):
+        # One-time flag so readers know to look at the shards.
+        writer.update(repos.users.ref(uid), {'sharded_counters': True})
+    counters.increment(repos, writer, uid, balance=REFERRAL_BONUS, referral_count=1)
+    return record_entry(repos, writer, uid, REFERRAL_BONUS, 'referral_bonus', description)
+
+
+def register_user(repos, user_ref, user_data, referrer_doc=None):
+    """Create a new user, with their signup and referral bonuses, in one commit.
+
+    With ``referrer_doc`` (the referrer's existing snapshot, at least
+    ``sharded_counters`` selected) the new user starts with SIGNUP_BONUS and
+    the referrer is credited through ``credit_referral``; both ledger rows go
+    in the same batch. The user document is written with ``create``, so when
+    two logins race to sign up the same uid the loser's whole commit fails
+    with AlreadyExists and nobody is credited twice.
+    """
+    batch = repos.batch()
+    if referrer_doc is not None:
+        user_data = {**user_data, 'balance': user_data.get('balance', 0.0) + SIGNUP_BONUS,
+                     'referred_by': referrer_doc.id}
+        record_entry(repos, batch, user_ref.id, SIGNUP_BONUS, 'signup_bonus', 'Welcome Bonus')
+        credit_referral(repos, batch, referrer_doc, user_data['name'])
+    batch.create(user_ref, user_data)
+    batch.commit()
+
+
+def hold_for_withdraw(repos, uid, amount, request_fields):
+    """Atomically check the balance, deduct ``amount`` and create the withdraw request.
+
+    Runs in a transaction so two concurrent withdrawals cannot both pass the
+    balance check. Pending counter shards are folded into the user document
+    in the same transaction. The request stores its hold entry's id
+    (``hold_entry_id``) for ``settle_withdraw``. Raises InsufficientBalance;
+    returns the request reference.
+    """
+    user_ref = repos.users.ref(uid)
+    req_ref = repos.withdraws.ref()
+
+    @firestore.transactional
+    def run(transaction):
+        snap = user_ref.get(['balance', 'sharded_counters'], transaction=transaction)
+        user = (snap.to_dict() or {}) if snap.exists else {}
+        folded = dict.fromkeys(counters.SHARDED_FIELDS, 0)
+        if user.get('sharded_counters'):
+            folded = counters.fold_into(repos, transaction, uid)
+        balance = user.get('balance', 0) + folded['balance']
+        if balance < amount:
+            raise InsufficientBalance(balance)
+
+        user_fields = {'referral_count': firestore.Increment(folded['referral_count'])} if folded['referral_count'] else {}
+        adjust_balance(repos, transaction, uid, folded['balance'] - amount, **user_fields)
+        hold_ref = record_entry(repos, transaction, uid, -amount, 'withdraw_hold')
+        transaction.set(req_ref, {
+            'uid': uid,
+            'amount': amount,
+            'status': 'pending',
+            'timestamp': datetime.datetime.now(),
+            'hold_entry_id': hold_ref.id,
+            **request_fields
+        })
+        return req_ref
+
+    return run(repos.transaction())
+
+
+def hold_entry(repos, req):
+    """Return the balance_history reference of a withdraw request's hold entry, or None."""
+    if req.get('hold_entry_id'):
+        return repos.ledger.ref(req['hold_entry_id'])
+    # Requests created before hold_entry_id existed: match the hold by its fields.
+    for doc in repos.ledger.where('uid', '==', req['uid'])\
+            .where(field_path='amount', op_string='==', value=-req['amount'])\
+            .where(field_path='type', op_string='==', value='withdraw_hold')\
+            .limit(1).stream():
+        return doc.reference
+    return None
+
+
+def settle_withdraw(repos, req_doc, paid):
+    """Mark a pending withdraw request paid or rejected in one batch.
+
+    The request update carries a ``last_update_time`` precondition, so a
+    request processed twice fails with FailedPrecondition. Rejecting refunds
+    the amount. The hold entry is rewritten by direct reference to
+    ``withdraw_paid`` / ``withdraw_rejected`` and, when paid, the user is
+    touched so their dashboard refreshes. If retention already deleted the
+    hold (or the paid user is gone), the request is settled without those
+    writes. NotFound (e.g. a deleted user on refund) and FailedPrecondition
+    propagate to the caller.
+    """
+    req = req_doc.to_dict()
+    hold_ref = hold_entry(repos, req)
+    if paid:
+        hold_update = {'type': 'withdraw_paid', 'description': f"Paid via {req.get('method')} ({req.get('number')})"}
+    else:
+        hold_update = {'type': 'withdraw_rejected', 'description': 'Withdraw Rejected (refunded)'}
+
+    def build(optional):
+        batch = repos.batch()
+        batch.update(req_doc.reference, {'status': 'paid' if paid else 'rejected'},
+                     option=repos.write_option(last_update_time=req_doc.update_time))
+        if not paid:
+            post(repos, req['uid'], req['amount'], 'withdraw_refund', 'Withdraw Rejected', writer=batch)
+        if optional and hold_ref is not None:
+            batch.update(hold_ref, hold_update)
+        if optional and paid:
+            touch_user(repos, batch, req['uid'])
+        return batch
+
+    try:
+        build(True).commit()
+    except firestore.NotFound:
+        if hold_ref is None and not paid:
+            raise
+        build(False).commit()
@@ -0,0 +1,590 @@
+"""In-memory stand-in for the Firestore client (``DATASTORE=memory``).
+
+Implements the subset of the google-cloud-firestore API this app uses, with
+the same semantics where they matter: field transforms (Increment,
+ArrayUnion/ArrayRemove, SERVER_TIMESTAMP, DELETE_FIELD), dotted update
+paths, ``create`` raising AlreadyExists, ``update`` raising NotFound,
+``last_update_time`` preconditions, query filters/ordering/cursors with the
+``__name__`` tie-break, projections, ``count()``, ``get_all`` and optimistic
+transactions that work with ``firestore.transactional``, and
+``on_snapshot`` query listeners delivered from a background thread.
+
+Nothing is persisted; every process starts empty. ``stats()`` reports
+billed document operations the way Firestore counts them (a query that
+returns nothing still costs one read, ``count()`` costs one read per 1000
+matches, deletes are billed separately from writes) plus the number of
+RPCs, for the budget checks in bench_budgets.py.
+"""
+import copy
+import enum
+import queue
+import datetime
+import itertools
+import threading
+import uuid
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a not in b,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(x in a for x in b),
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array-contains': lambda a, b: isinstance(a, list) and b in a,
+}
+_MISSING = object()
+
+
+def _get_path(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+class Snapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_path(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+ChangeType = enum.Enum('ChangeType', 'ADDED REMOVED MODIFIED')
+
+
+class DocumentChange:
+    def __init__(self, type, document):
+        self.type = type
+        self.document = document
+
+
+class Watch:
+    """An ``on_snapshot`` listener: re-runs its query after commits and reports what changed."""
+
+    def __init__(self, query, callback):
+        self._query = query
+        self._callback = callback
+        self._seen = None
+
+    def _check(self):
+        snaps = self._query._run(charge=False)
+        current = {s.reference.path: s for s in snaps}
+        first = self._seen is None
+        seen = self._seen or {}
+        changes = [DocumentChange(ChangeType.REMOVED, snap) for path, snap in seen.items() if path not in current]
+        for path, snap in current.items():
+            if path not in seen:
+                changes.append(DocumentChange(ChangeType.ADDED, snap))
+            elif seen[path].update_time != snap.update_time:
+                changes.append(DocumentChange(ChangeType.MODIFIED, snap))
+        self._seen = current
+        if first or changes:
+            # Listeners are billed one read per added or changed document
+            self._query._client._count(reads=max(1, len(snaps)) if first else
+                                       sum(1 for c in changes if c.type is not ChangeType.REMOVED))
+            self._callback(snaps, changes, self._query._client._now())
+
+    def unsubscribe(self):
+        self._query._client._unwatch(self)
+
+
+class MemoryClient:
+    """Drop-in for ``google.cloud.firestore.Client`` backed by a dict of document paths."""
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.RLock()
+        self._clock = itertools.count(1)
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.rpcs = 0
+        self._epoch = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self._watches = []
+        self._watch_queue = queue.Queue()
+        self._watch_thread = None
+
+    def stats(self):
+        return {'reads': self.reads, 'writes': self.writes, 'deletes': self.deletes, 'rpcs': self.rpcs}
+
+    def reset_stats(self):
+        with self._lock:
+            self.reads = self.writes = self.deletes = self.rpcs = 0
+
+    def _count(self, reads=0, writes=0, deletes=0, rpcs=0):
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+            self.deletes += deletes
+            self.rpcs += rpcs
+
+    def _now(self):
+        return self._epoch + datetime.timedelta(microseconds=next(self._clock))
+
+    def collection(self, name):
+        return CollectionRef(self, name)
+
+    def collection_group(self, name):
+        return Query(self, '**/' + name)
+
+    def document(self, path):
+        col, _, doc_id = path.rpartition('/')
+        return DocumentRef(self, col, doc_id)
+
+    def batch(self):
+        return Batch(self)
+
+    @staticmethod
+    def write_option(last_update_time=None, exists=None):
+        return last_update_time
+
+    def transaction(self, **kwargs):
+        return Transaction(self, **kwargs)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._count(rpcs=1)
+        for ref in references:
+            snap = self._snapshot(ref, field_paths)
+            if transaction is not None:
+                transaction._reads[ref.path] = snap.update_time
+            yield snap
+
+    def _snapshot(self, ref, field_paths=None):
+        self._count(reads=1)
+        with self._lock:
+            entry = self._docs.get(ref.path)
+            if entry is None:
+                return Snapshot(ref, None)
+            data = copy.deepcopy(entry['data'])
+        if field_paths is not None:
+            projected = {}
+            for f in field_paths:
+                v = _get_path(data, f)
+                if v is not _MISSING:
+                    projected[f] = v
+            data = projected
+        return Snapshot(ref, data, entry['create_time'], entry['update_time'])
+
+    def _watch(self, query, callback):
+        watch = Watch(query, callback)
+        with self._lock:
+            self._watches.append(watch)
+            if self._watch_thread is None:
+                self._watch_thread = threading.Thread(target=self._deliver, name='memory-watch', daemon=True)
+                self._watch_thread.start()
+        self._watch_queue.put(watch)
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _deliver(self):
+        while True:
+            target = self._watch_queue.get()
+            with self._lock:
+                watches = list(self._watches)
+            for watch in watches:
+                if target is not None and watch is not target:
+                    continue
+                try:
+                    watch._check()
+                except Exception as e:
+                    print(f"Memory Watch Error: {e}")
+
+    def _commit_writes(self, writes):
+        self._count(rpcs=1)
+        return self._apply(writes)
+
+    def _apply(self, writes):
+        with self._lock:
+            now = self._now()
+            deletes = sum(1 for kind, _, _, _ in writes if kind == 'delete')
+            self._count(writes=len(writes) - deletes, deletes=deletes)
+            staged = dict(self._docs)
+            for kind, ref, data, option in writes:
+                entry = staged.get(ref.path)
+                if option is not None and (entry is None or entry['update_time'] != option):
+                    raise exceptions.FailedPrecondition('update_time precondition failed')
+                if kind == 'create':
+                    if entry is not None:
+                        raise exceptions.AlreadyExists(f'Document already exists: {ref.path}')
+                    staged[ref.path] = {'data': self._transform({}, data, now, nested=True), 'create_time': now, 'update_time': now}
+                elif kind == 'set':
+                    base = copy.deepcopy(entry['data']) if (entry and data[1]) else {}
+                    staged[ref.path] = {'data': self._transform(base, data[0], now, nested=True, merge=data[1]),
+                                        'create_time': entry['create_time'] if entry else now, 'update_time': now}
+                elif kind == 'update':
+                    if entry is None:
+                        raise exceptions.NotFound(f'No document to update: {ref.path}')
+                    staged[ref.path] = {'data': self._transform(copy.deepcopy(entry['data']), data, now),
+                                        'create_time': entry['create_time'], 'update_time': now}
+                elif kind == 'delete':
+                    staged.pop(ref.path, None)
+            self._docs = staged
+            if self._watches:
+                self._watch_queue.put(None)
+            return now
+
+    def _transform(self, base, changes, now, nested=False, merge=False):
+        for key, value in changes.items():
+            if nested and isinstance(value, dict) and not merge:
+                parts = [key]
+            else:
+                parts = key.split('.') if not nested else [key]
+            target = base
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            leaf = parts[-1]
+            if nested and merge and isinstance(value, dict) and isinstance(target.get(leaf), dict):
+                self._transform(target[leaf], value, now, nested=True, merge=True)
+                continue
+            current = target.get(leaf)
+            if value is transforms.DELETE_FIELD:
+                target.pop(leaf, None)
+            elif value is transforms.SERVER_TIMESTAMP:
+                target[leaf] = now
+            elif isinstance(value, transforms.Increment):
+                target[leaf] = (current if isinstance(current, (int, float)) else 0) + value.value
+            elif isinstance(value, transforms.ArrayUnion):
+                arr = list(current) if isinstance(current, list) else []
+                arr.extend(v for v in value.values if v not in arr)
+                target[leaf] = arr
+            elif isinstance(value, transforms.ArrayRemove):
+                arr = list(current) if isinstance(current, list) else []
+                target[leaf] = [v for v in arr if v not in value.values]
+            else:
+                target[leaf] = copy.deepcopy(value)
+        return base
+
+
+class DocumentRef:
+    def __init__(self, client, parent_path, doc_id):
+        self._client = client
+        self._parent_path = parent_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f'{self._parent_path}/{self.id}'
+
+    @property
+    def parent(self):
+        return CollectionRef(self._client, self._parent_path)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentRef) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, name):
+        return CollectionRef(self._client, f'{self.path}/{name}')
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._count(rpcs=1)
+        snap = self._client._snapshot(self, field_paths)
+        if transaction is not None:
+            transaction._reads[self.path] = snap.update_time
+        return snap
+
+    def create(self, data):
+        return self._client._commit_writes([('create', self, data, None)])
+
+    def set(self, data, merge=False):
+        return self._client._commit_writes([('set', self, (data, merge), None)])
+
+    def update(self, data, option=None):
+        return self._client._commit_writes([('update', self, data, option)])
+
+    def delete(self, option=None):
+        return self._client._commit_writes([('delete', self, None, option)])
+
+
+class Query:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, offset=0,
+                 start=None, end=None, projection=None, limit_to_last=False):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._start = start
+        self._end = end
+        self._projection = projection
+        self._limit_to_last = limit_to_last
+
+    def _copy(self, **kw):
+        args = dict(filters=self._filters, orders=self._orders, limit=self._limit, offset=self._offset,
+                    start=self._start, end=self._end, projection=self._projection,
+                    limit_to_last=self._limit_to_last)
+        args.update(kw)
+        return Query(self._client, self._path, **args)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit=count, limit_to_last=True)
+
+    def offset(self, num):
+        return self._copy(offset=num)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_after(self, cursor):
+        return self._copy(start=cursor)
+
+    def end_before(self, cursor):
+        return self._copy(end=cursor)
+
+    def count(self, alias=None):
+        return AggregationQuery(self, alias or 'field_1')
+
+    def _cursor_key(self, cursor):
+        if isinstance(cursor, Snapshot):
+            data = cursor._data or {}
+            values = [cursor.id if f == '__name__' else _get_path(data, f) for f, _ in self._order_fields()]
+        elif isinstance(cursor, dict):
+            values = [cursor.get(f, _MISSING) for f, _ in self._order_fields()]
+        else:
+            values = list(cursor)
+        return values
+
+    def _order_fields(self):
+        orders = list(self._orders)
+        if not any(f == '__name__' for f, _ in orders):
+            last = orders[-1][1] if orders else 'ASCENDING'
+            orders.append(('__name__', last))
+        return orders
+
+    def _compare(self, snap, cursor_values):
+        for (field, direction), cv in zip(self._order_fields(), cursor_values):
+            if cv is _MISSING:
+                break
+            v = snap.id if field == '__name__' else _get_path(snap._data, field)
+            if v == cv:
+                continue
+            result = -1 if v < cv else 1
+            return -result if direction == 'DESCENDING' else result
+        return 0
+
+    def _run(self, charge=True):
+        prefix = self._path + '/'
+        group = self._path[3:] if self._path.startswith('**/') else None
+        with self._client._lock:
+            if group:
+                items = [(p, e) for p, e in self._client._docs.items()
+                         if p.rsplit('/', 2)[-2] == group]
+            else:
+                items = [(p, e) for p, e in self._client._docs.items()
+                         if p.startswith(prefix) and '/' not in p[len(prefix):]]
+        snaps = []
+        for path, entry in items:
+            parent, _, doc_id = path.rpartition('/')
+            ref = DocumentRef(self._client, parent, doc_id)
+            snaps.append(Snapshot(ref, copy.deepcopy(entry['data']), entry['create_time'], entry['update_time']))
+        for field, op, value in self._filters:
+            def keep(s, field=field, op=op, value=value):
+                v = s.id if field == '__name__' else _get_path(s._data, field)
+                if v is _MISSING:
+                    return False
+                try:
+                    return _OPS[op](v, value)
+                except TypeError:
+                    return False
+            snaps = [s for s in snaps if keep(s)]
+        for field, _ in self._orders:
+            if field != '__name__':
+                snaps = [s for s in snaps if _get_path(s._data, field) is not _MISSING]
+        for field, direction in reversed(self._order_fields()):
+            snaps.sort(key=lambda s, f=field: _SortKey(s.id if f == '__name__' else _get_path(s._data, f)),
+                       reverse=(direction == 'DESCENDING'))
+        if self._start is not None:
+            cv = self._cursor_key(self._start)
+            snaps = [s for s in snaps if self._compare(s, cv) > 0]
+        if self._end is not None:
+            cv = self._cursor_key(self._end)
+            snaps = [s for s in snaps if self._compare(s, cv) < 0]
+        snaps = snaps[self._offset:]
+        if self._limit is not None:
+            snaps = snaps[-self._limit:] if self._limit_to_last else snaps[:self._limit]
+        if charge:
+            self._client._count(reads=max(1, len(snaps)), rpcs=1)
+        if self._projection is not None:
+            for s in snaps:
+                s._data = {f: _get_path(s._data, f) for f in self._projection
+                           if _get_path(s._data, f) is not _MISSING}
+        return snaps
+
+    def stream(self, transaction=None):
+        snaps = self._run()
+        if transaction is not None:
+            for s in snaps:
+                transaction._reads[s.reference.path] = s.update_time
+        yield from snaps
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class _SortKey:
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        try:
+            return self.value < other.value
+        except TypeError:
+            return str(type(self.value)) < str(type(other.value))
+
+
+class CollectionRef(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rpartition('/')[2]
+
+    @property
+    def parent(self):
+        if '/' not in self._path:
+            return None
+        doc_path, _, _ = self._path.rpartition('/')
+        col, _, doc_id = doc_path.rpartition('/')
+        return DocumentRef(self._client, col, doc_id)
+
+    def document(self, doc_id=None):
+        return DocumentRef(self._client, self._path, uuid.uuid4().hex[:20] if doc_id is None else doc_id)
+
+    def add(self, data):
+        ref = self.document()
+        update_time = ref.create(data)
+        return update_time, ref
+
+    def list_documents(self):
+        return [s.reference for s in self._run()]
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        matched = len(self._query._run(charge=False))
+        self._query._client._count(reads=max(1, -(-matched // 1000)), rpcs=1)
+        return [[AggregationResult(self._alias, matched)]]
+
+
+class Batch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, ref, data):
+        self._writes.append(('create', ref, data, None))
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(('set', ref, (data, merge), None))
+
+    def update(self, ref, data, option=None):
+        self._writes.append(('update', ref, data, option))
+
+    def delete(self, ref, option=None):
+        self._writes.append(('delete', ref, None, option))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        if writes:
+            self._client._commit_writes(writes)
+        return writes
+
+
+class Transaction(Batch):
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._count(rpcs=1)
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._client._count(rpcs=1)
+        self._clean_up()
+
+    def _commit(self):
+        self._client._count(rpcs=1)
+        with self._client._lock:
+            for path, seen in self._reads.items():
+                entry = self._client._docs.get(path)
+                if (entry['update_time'] if entry else None) != seen:
+                    self._clean_up()
+                    raise exceptions.Aborted('Transaction contention')
+            writes = self._writes
+            if writes:
+                self._client._apply(writes)
+        self._clean_up()
+        return writes
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentRef):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
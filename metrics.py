@@ -0,0 +1,267 @@
+"""Request metrics: per-route latency, Firestore RPCs/documents and outbound HTTP time.
+
+``init_app(app, db)`` installs the Flask hooks and instruments the datastore
+client (when it is first built): the real Firestore client through its gapic ``_firestore_api``
+methods, the in-memory store through its ``_count`` hook. Every request gets
+a ``Server-Timing`` header; ``registry.render()`` produces the Prometheus
+text format served by the admin metrics endpoint. Numbers are per process
+(each serverless instance keeps its own).
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from flask import g, request
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# gapic method -> documents billed per streamed response
+_STREAMING_READS = {
+    'batch_get_documents': lambda response: 1,  # found and missing documents both bill a read
+    'run_query': lambda response: 1 if 'document' in response else 0,
+    'run_aggregation_query': lambda response: 1,
+}
+_UNARY = ('commit', 'begin_transaction', 'rollback', 'list_documents', 'batch_write')
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    """What one request spent; shared with fan_out threads through the copied context."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.route = None
+        self.rpcs = 0
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.firestore_seconds = 0.0
+        self.http_calls = 0
+        self.http_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **amounts):
+        with self._lock:
+            for field, amount in amounts.items():
+                setattr(self, field, getattr(self, field) + amount)
+
+
+class Registry:
+    """Minimal thread-safe Prometheus counters and histograms."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, labels=(), amount=1):
+        if not amount:
+            return
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(labels))
+        with self._lock:
+            counts = self._histograms.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+
+        lines = []
+        for kind, series in (('counter', counters), ('histogram', histograms)):
+            for name in sorted({name for name, _ in series}):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name != name:
+                        continue
+                    if kind == 'counter':
+                        lines.append(f"{name}{_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(self.buckets, value):
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {value[-2]}")
+                    lines.append(f"{name}_count{_labels(labels)} {value[-2]}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value[-1]:.6f}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'Request latency by route.')
+registry.describe('firestore_rpcs_total', 'Firestore RPCs by route and method.')
+registry.describe('firestore_documents_total', 'Billed Firestore document operations by route and kind.')
+registry.describe('firestore_rpc_duration_seconds', 'Firestore RPC latency by method.')
+registry.describe('outbound_http_duration_seconds', 'Outbound HTTP call latency by target.')
+
+
+def _route():
+    stats = _current.get()
+    return getattr(stats, 'route', None) or 'background'
+
+
+def record_firestore(method, seconds=None, rpcs=1, reads=0, writes=0, deletes=0):
+    """Account Firestore work to the current request (if any) and the process totals."""
+    route = _route()
+    registry.inc('firestore_rpcs_total', (('route', route), ('method', method)), rpcs)
+    for kind, amount in (('read', reads), ('write', writes), ('delete', deletes)):
+        registry.inc('firestore_documents_total', (('route', route), ('kind', kind)), amount)
+    if seconds is not None:
+        registry.observe('firestore_rpc_duration_seconds', (('method', method),), seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.add(rpcs=rpcs, reads=reads, writes=writes, deletes=deletes,
+                  firestore_seconds=seconds or 0.0)
+
+
+@contextmanager
+def track_http(target):
+    """Time an outbound HTTP call (imgbb, Telegram)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        registry.observe('outbound_http_duration_seconds', (('target', target),), seconds)
+        stats = _current.get()
+        if stats is not None:
+            stats.add(http_calls=1, http_seconds=seconds)
+
+
+def _commit_counts(request_pb):
+    writes = deletes = 0
+    for write in (request_pb or {}).get('writes', ()):
+        if getattr(write, 'delete', None):
+            deletes += 1
+        else:
+            writes += 1
+    return writes, deletes
+
+
+def _wrap_unary(method, fn):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            writes, deletes = _commit_counts(kwargs.get('request')) if method in ('commit', 'batch_write') else (0, 0)
+            record_firestore(method, time.perf_counter() - t0, writes=writes, deletes=deletes)
+    return wrapper
+
+
+def _wrap_streaming(method, fn, reads_for):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        responses = fn(*args, **kwargs)
+
+        def stream():
+            reads = 0
+            try:
+                for response in responses:
+                    reads += reads_for(response)
+                    yield response
+            finally:
+                # An empty result still bills one read.
+                record_firestore(method, time.perf_counter() - t0, reads=max(reads, 1))
+        return stream()
+    return wrapper
+
+
+def instrument_firestore(db):
+    """Count RPCs and documents on ``db`` (real Firestore client or memory_store).
+
+    A ``firebase_setup.LazyClient`` is instrumented once it builds its client.
+    """
+    if hasattr(type(db), 'when_ready'):
+        db.when_ready(instrument_firestore)
+        return
+    if getattr(db, '_metrics_instrumented', False):
+        return
+    if hasattr(db, '_count'):
+        # memory_store: no network, so only the counts are interesting
+        count = db._count
+
+        def counted(reads=0, writes=0, deletes=0, rpcs=0):
+            count(reads=reads, writes=writes, deletes=deletes, rpcs=rpcs)
+            record_firestore('memory', rpcs=rpcs, reads=reads, writes=writes, deletes=deletes)
+        db._count = counted
+    else:
+        api = db._firestore_api
+        for method, reads_for in _STREAMING_READS.items():
+            setattr(api, method, _wrap_streaming(method, getattr(api, method), reads_for))
+        for method in _UNARY:
+            setattr(api, method, _wrap_unary(method, getattr(api, method)))
+    db._metrics_instrumented = True
+
+
+def render_summary(name, summary, help_text=None):
+    """Prometheus summary lines for a ``LatencyRecorder.summary()`` keyed by query name."""
+    lines = [f"# HELP {name} {help_text}"] if help_text else []
+    lines.append(f"# TYPE {name} summary")
+    for query, values in sorted(summary.items()):
+        for quantile, key in (('0.5', 'p50'), ('0.99', 'p99')):
+            if values[key] is not None:
+                lines.append(f"{name}{_labels((('query', query), ('quantile', quantile)))} {values[key]:.6f}")
+        lines.append(f"{name}_count{_labels((('query', query),))} {values['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(stats, total):
+    fs = f'fs;dur={stats.firestore_seconds * 1000:.1f};desc="{stats.rpcs} rpc, {stats.reads} read, {stats.writes + stats.deletes} write"'
+    http = f'http;dur={stats.http_seconds * 1000:.1f};desc="{stats.http_calls} call"'
+    return f'app;dur={total * 1000:.1f}, {fs}, {http}'
+
+
+def init_app(app, db):
+    """Install request hooks on ``app`` and instrument ``db``."""
+    instrument_firestore(db)
+
+    @app.before_request
+    def _start_request_metrics():
+        stats = RequestStats()
+        stats.route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g._metrics_token = _current.set(stats)
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        stats = _current.get()
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats.started
+        labels = (('route', stats.route), ('method', request.method), ('status', response.status_code))
+        registry.observe('http_request_duration_seconds', labels, total)
+        registry.inc('outbound_http_seconds_total', (('route', stats.route),), stats.http_seconds)
+        response.headers['Server-Timing'] = server_timing(stats, total)
+        return response
+
+    @app.teardown_request
+    def _end_request_metrics(exc=None):
+        token = g.pop('_metrics_token', None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:  # torn down in a different context; nothing to restore
+                pass
@@ -0,0 +1,106 @@
+import os
+import threading
+from collections import deque
+
+MODERATION_LISTENER = os.getenv("MODERATION_LISTENER", "0") == "1"  # long-lived workers only
+MODERATION_PAGE_SIZE = int(os.getenv("MODERATION_PAGE_SIZE", 50))
+MODERATION_KEEPALIVE = float(os.getenv("MODERATION_KEEPALIVE", 15))
+MODERATION_STREAM_SECONDS = float(os.getenv("MODERATION_STREAM_SECONDS", 300))
+MODERATION_HISTORY = int(os.getenv("MODERATION_HISTORY", 1000))
+
+# Repositories attribute of each pending queue.
+QUEUES = ('submissions', 'activations', 'withdraws')
+
+
+class ModerationQueue:
+    """Live in-memory copy of the pending moderation queues.
+
+    ``listen()`` opens one ``on_snapshot`` listener per pending query, so
+    after the initial snapshot Firestore only bills the documents that
+    enter, change or leave a queue, no matter how often admins reload.
+    Every change gets a version number; ``page()`` returns the first slice
+    of each queue with the current version and ``changes_since(version)``
+    blocks until there is something newer (the Server-Sent Events stream
+    behind the admin page). Only the last MODERATION_HISTORY changes are
+    kept; a client further behind is told to reload.
+
+    Needs a process that outlives requests (gunicorn, a VM); on serverless
+    leave MODERATION_LISTENER off and ``live`` stays False.
+    """
+
+    def __init__(self, repos, history=MODERATION_HISTORY):
+        self.repos = repos
+        self._items = {name: {} for name in QUEUES}
+        self._synced = set()
+        self._version = 0
+        self._log = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self._watches = []
+
+    @property
+    def live(self):
+        """True once every queue has received its initial snapshot."""
+        return len(self._synced) == len(QUEUES)
+
+    def listen(self):
+        if self._watches:
+            return self._watches
+        try:
+            for name in QUEUES:
+                query = getattr(self.repos, name).pending()
+                self._watches.append(query.on_snapshot(
+                    lambda docs, changes, read_time, name=name: self._on_snapshot(name, changes)))
+        except Exception as e:
+            print(f"Moderation Listener Error: {e}")
+        return self._watches
+
+    def close(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+        with self._cond:
+            self._synced.clear()
+
+    def _on_snapshot(self, name, changes):
+        with self._cond:
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    if self._items[name].pop(doc.id, None) is None:
+                        continue
+                    event = {'queue': name, 'op': 'remove', 'id': doc.id}
+                else:
+                    item = {'id': doc.id, **doc.to_dict()}
+                    self._items[name][doc.id] = item
+                    event = {'queue': name, 'op': 'upsert', 'id': doc.id, 'item': item}
+                self._version += 1
+                self._log.append((self._version, event))
+            self._synced.add(name)
+            self._cond.notify_all()
+
+    def _totals(self):
+        return {name: len(items) for name, items in self._items.items()}
+
+    def page(self, limit=MODERATION_PAGE_SIZE):
+        """``(version, {queue: first limit items}, {queue: total})``, in document id order like the query."""
+        with self._cond:
+            queues = {name: [dict(items[doc_id]) for doc_id in sorted(items)[:limit]]
+                      for name, items in self._items.items()}
+            return self._version, queues, self._totals()
+
+    def changes_since(self, version, timeout=MODERATION_KEEPALIVE):
+        """Wait up to ``timeout`` seconds for changes after ``version``.
+
+        Returns ``(version, events, totals)``; ``events`` is empty on timeout
+        and None when ``version`` is unknown or too old to replay.
+        """
+        with self._cond:
+            oldest = self._log[0][0] if self._log else self._version + 1
+            if version is None or version > self._version or version < oldest - 1:
+                return self._version, None, self._totals()
+            self._cond.wait_for(lambda: self._version > version, timeout=timeout)
+            oldest = self._log[0][0] if self._log else self._version + 1
+            if version < oldest - 1:
+                return self._version, None, self._totals()
+            events = [event for v, event in self._log if v > version]
+            return self._version, events, self._totals()
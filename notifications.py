@@ -0,0 +1,139 @@
+import os
+import time
+import queue
+import threading
+
+import metrics
+
+NOTIFY_INTERVAL = float(os.getenv("NOTIFY_INTERVAL", 2))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", 1000))
+NOTIFY_RETRIES = int(os.getenv("NOTIFY_RETRIES", 3))
+NOTIFY_BACKOFF = float(os.getenv("NOTIFY_BACKOFF", 1))
+NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", 10))
+NOTIFY_INLINE_TIMEOUT = float(os.getenv("NOTIFY_INLINE_TIMEOUT", 2))
+NOTIFY_BACKGROUND = os.getenv("NOTIFY_BACKGROUND", "0") == "1"  # long-lived workers only
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class TelegramSender:
+    """Posts a message to one Telegram chat over a keep-alive session."""
+
+    def __init__(self, bot_token, chat_id, api_url="https://api.telegram.org", timeout=NOTIFY_TIMEOUT):
+        self.url = f"{api_url.rstrip('/')}/bot{bot_token}/sendMessage"
+        self.configured = bool(bot_token and chat_id)
+        self.chat_id = chat_id
+        self.timeout = timeout
+        self.session = None  # created by the first send; keeps requests out of cold starts
+
+    def __call__(self, text, timeout=None):
+        if not self.configured:
+            raise RuntimeError("TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID are not set")
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        with metrics.track_http('telegram'):
+            response = self.session.post(self.url, json={
+                "chat_id": self.chat_id,
+                "text": text,
+                "parse_mode": "HTML"
+            }, timeout=timeout or self.timeout)
+        response.raise_for_status()
+
+
+class NotificationDispatcher:
+    """Delivers notifications, optionally from a background thread.
+
+    By default ``send()`` delivers before returning, as a single attempt
+    capped at NOTIFY_INLINE_TIMEOUT seconds: a serverless instance (Vercel)
+    is frozen once the response is sent, so anything still queued would be
+    dropped, and a slow Telegram must not hold the request. With
+    NOTIFY_BACKGROUND=1 (a process that outlives requests) ``send()`` never
+    blocks the request; messages that arrive within ``interval`` seconds of
+    each other are coalesced into one delivery, retried with exponential
+    backoff. Either way texts are split at ``limit`` characters.
+    ``sender(text, timeout)`` is any callable (``timeout=None`` means its
+    own default), so tests can plug in a local stub.
+    """
+
+    def __init__(self, sender, interval=NOTIFY_INTERVAL, queue_size=NOTIFY_QUEUE_SIZE,
+                 retries=NOTIFY_RETRIES, backoff=NOTIFY_BACKOFF, limit=TELEGRAM_MESSAGE_LIMIT,
+                 background=NOTIFY_BACKGROUND, inline_timeout=NOTIFY_INLINE_TIMEOUT):
+        self.sender = sender
+        self.background = background
+        self.inline_timeout = inline_timeout
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = limit
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='notify', daemon=True)
+                self._thread.start()
+
+    def send(self, message):
+        if not self.background:
+            # On the request path: one short attempt, no backoff sleeps.
+            for text in self._pack([message]):
+                self._deliver(text, attempts=1, timeout=self.inline_timeout)
+            return
+
+        self._start()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            print("Notification Queue Full: message dropped")
+
+    def join(self):
+        """Block until every queued message has been delivered or given up on."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            burst = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    burst.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                for text in self._pack(burst):
+                    self._deliver(text)
+            finally:
+                for _ in burst:
+                    self._queue.task_done()
+
+    def _pack(self, messages):
+        """Join messages into as few texts as fit under the size limit."""
+        chunks = []
+        current = ""
+        for message in messages:
+            message = message.strip()[:self.limit]
+            if current and len(current) + len(message) + 2 > self.limit:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{message}" if current else message
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _deliver(self, text, attempts=None, timeout=None):
+        attempts = attempts or self.retries
+        for attempt in range(attempts):
+            try:
+                self.sender(text, timeout)
+                return True
+            except Exception as e:
+                print(f"Notification Error (attempt {attempt + 1}): {e}")
+                if attempt + 1 < attempts:
+                    time.sleep(self.backoff * (2 ** attempt))
+        return False
@@ -0,0 +1,156 @@
+class Repository:
+    """Access to one collection. Returns the client's own refs, queries and snapshots.
+
+    Works with any client that speaks the Firestore API, i.e. the real
+    client or ``memory_store.MemoryClient`` (see firebase_setup).
+    """
+
+    name = None
+
+    def __init__(self, db):
+        self.db = db
+
+    def collection(self):
+        return self.db.collection(self.name)
+
+    def ref(self, doc_id=None):
+        """Reference to ``doc_id``, or to a new auto-id document."""
+        return self.collection().document(doc_id)
+
+    def get(self, doc_id, field_paths=None, transaction=None):
+        return self.ref(doc_id).get(field_paths, transaction=transaction)
+
+    def get_many(self, doc_ids, field_paths=None):
+        return self.db.get_all([self.ref(doc_id) for doc_id in doc_ids], field_paths=field_paths)
+
+    def add(self, data):
+        """Create an auto-id document; returns ``(update_time, ref)`` like the client."""
+        return self.collection().add(data)
+
+    def where(self, field, op, value):
+        return self.collection().where(field_path=field, op_string=op, value=value)
+
+    def count(self):
+        return self.collection().count().get()[0][0].value
+
+
+class PendingQueueMixin:
+    def pending(self):
+        return self.where('status', '==', 'pending')
+
+
+class UserRepository(Repository):
+    name = 'users'
+
+    def newest(self):
+        """All users, newest first; the document id breaks created_at ties (keyset pagination)."""
+        return self.collection()\
+            .order_by('created_at', direction='DESCENDING')\
+            .order_by('__name__', direction='DESCENDING')
+
+    def referred_by(self, uid):
+        return self.where('referred_by', '==', uid)\
+            .order_by('created_at', direction='DESCENDING')\
+            .order_by('__name__', direction='DESCENDING')
+
+
+class TaskRepository(Repository):
+    name = 'tasks'
+
+    def newest(self):
+        """The catalog, newest first; the document id breaks created_at ties (keyset pagination)."""
+        return self.collection()\
+            .order_by('created_at', direction='DESCENDING')\
+            .order_by('__name__', direction='DESCENDING')
+
+
+class SubmissionRepository(PendingQueueMixin, Repository):
+    name = 'task_submissions'
+
+
+class LedgerRepository(Repository):
+    name = 'balance_history'
+
+    def for_user(self, uid):
+        """A user's balance history, newest first."""
+        return self.where('uid', '==', uid).order_by('timestamp', direction='DESCENDING')
+
+
+class WithdrawRepository(PendingQueueMixin, Repository):
+    name = 'withdraw_requests'
+
+
+class ActivationRepository(PendingQueueMixin, Repository):
+    name = 'activation_requests'
+
+
+class NoticeRepository(Repository):
+    name = 'notices'
+
+    def newest(self):
+        """Notices, newest first; the document id breaks date ties (keyset pagination)."""
+        return self.collection()\
+            .order_by('date', direction='DESCENDING')\
+            .order_by('__name__', direction='DESCENDING')
+
+
+class SettingsRepository(Repository):
+    name = 'settings'
+
+
+class CounterShardRepository(Repository):
+    """``users/{uid}/counter_shards``: the per-user subcollection behind ``counters``."""
+
+    name = 'counter_shards'
+
+    def for_user(self, uid):
+        return self.db.collection(UserRepository.name).document(uid).collection(self.name)
+
+    def all_users(self):
+        return self.db.collection_group(self.name)
+
+
+class CacheVersionRepository(Repository):
+    name = 'cache_versions'
+
+
+class JobRepository(Repository):
+    """Progress documents of background jobs (e.g. ``jobs/retention``)."""
+
+    name = 'jobs'
+
+
+class Repositories:
+    """One repository per collection, all sharing the same client.
+
+    Writes that span collections go through ``batch()`` / ``transaction()``
+    and multi-document reads through ``get_all()``, so callers never need
+    the raw client.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.users = UserRepository(db)
+        self.tasks = TaskRepository(db)
+        self.submissions = SubmissionRepository(db)
+        self.ledger = LedgerRepository(db)
+        self.withdraws = WithdrawRepository(db)
+        self.activations = ActivationRepository(db)
+        self.notices = NoticeRepository(db)
+        self.settings = SettingsRepository(db)
+        self.counter_shards = CounterShardRepository(db)
+        self.cache_versions = CacheVersionRepository(db)
+        self.jobs = JobRepository(db)
+
+    def batch(self):
+        return self.db.batch()
+
+    def transaction(self):
+        return self.db.transaction()
+
+    def get_all(self, refs, field_paths=None):
+        return self.db.get_all(refs, field_paths=field_paths)
+
+    def write_option(self, **kwargs):
+        """Write precondition, e.g. ``write_option(last_update_time=snap.update_time)``."""
+        return self.db.write_option(**kwargs)
@@ -0,0 +1,76 @@
+import os
+import datetime
+from datetime import timedelta
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 15))
+RETENTION_MAX_DOCS = int(os.getenv("RETENTION_MAX_DOCS", 2000))
+RETENTION_BATCH = 400  # Firestore allows 500 writes per batch
+
+# (repository, statuses that may be deleted). Only finished items are purged,
+# so pending queue entries and the users' task counters are never touched.
+RETENTION_RULES = [
+    ('submissions', ['approved', 'rejected']),
+    ('ledger', None),
+    ('withdraws', ['paid', 'rejected']),
+]
+
+
+def run_retention(repos, max_docs=RETENTION_MAX_DOCS, now=None):
+    """Delete documents older than RETENTION_DAYS in batched writes.
+
+    Work is capped at ``max_docs`` deletions per run. Progress (current
+    collection and last deleted timestamp) is kept in ``jobs/retention`` so
+    the next run resumes where this one stopped instead of rescanning.
+    Returns ``{collection: deleted_count}``.
+    """
+    now = now or datetime.datetime.now()
+    cutoff = now - timedelta(days=RETENTION_DAYS)
+    state_ref = repos.jobs.ref('retention')
+    state_doc = state_ref.get()
+    state = state_doc.to_dict() if state_doc.exists else {}
+
+    # Progress and results are keyed by collection name.
+    names = [getattr(repos, attr).name for attr, _ in RETENTION_RULES]
+    stage = names.index(state['stage']) if state.get('stage') in names else 0
+    after = state.get('after')
+    deleted = {}
+    budget = max_docs
+
+    for offset in range(len(RETENTION_RULES)):
+        attr, statuses = RETENTION_RULES[(stage + offset) % len(RETENTION_RULES)]
+        repo = getattr(repos, attr)
+        name = repo.name
+        if offset:
+            after = None
+        count = 0
+        finished = False
+
+        while budget > 0:
+            query = repo.where('timestamp', '<', cutoff)
+            if statuses:
+                query = query.where(field_path='status', op_string='in', value=statuses)
+            query = query.order_by('timestamp')
+            if after is not None:
+                query = query.start_after({'timestamp': after})
+            docs = list(query.select(['timestamp']).limit(min(RETENTION_BATCH, budget)).stream())
+            if not docs:
+                finished = True
+                break
+
+            batch = repos.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            batch.commit()
+
+            count += len(docs)
+            budget -= len(docs)
+            after = docs[-1].to_dict()['timestamp']
+
+        deleted[name] = count
+        if not finished:
+            # Out of budget: the next run resumes from this cursor.
+            state_ref.set({'stage': name, 'after': after, 'updated_at': now})
+            return deleted
+
+    state_ref.set({'stage': names[0], 'after': None, 'updated_at': now})
+    return deleted
@@ -0,0 +1,73 @@
+import os
+
+from cache import TTLCache, VersionStamp
+
+SETTINGS_CACHE_TTL = int(os.getenv("SETTINGS_CACHE_TTL", 300))
+SETTINGS_CACHE_STALENESS = int(os.getenv("SETTINGS_CACHE_STALENESS", 30))
+SETTINGS_LISTENER = os.getenv("SETTINGS_LISTENER", "0") == "1"  # long-lived workers only
+
+_MISSING = object()
+
+
+class SettingsCache:
+    """Process-wide cache of ``settings/{name}`` documents (system notice, runtime flags).
+
+    Reads hit memory first; a missing document is cached as ``None``. Admin
+    writes go through ``set()``, which updates the local copy and bumps the
+    ``settings`` version stamp so other instances drop theirs within
+    SETTINGS_CACHE_STALENESS seconds. ``listen()`` attaches a Firestore
+    snapshot listener instead, for processes that live long enough to keep
+    a stream open.
+    """
+
+    def __init__(self, repos, ttl=SETTINGS_CACHE_TTL, staleness=SETTINGS_CACHE_STALENESS):
+        self.repos = repos
+        self.cache = TTLCache(maxsize=64, ttl=ttl)
+        self.version = VersionStamp(repos, 'settings', staleness=staleness)
+        self._watch = None
+
+    def _ref(self, name):
+        return self.repos.settings.ref(name)
+
+    def get(self, name, default=None):
+        """Return the ``settings/{name}`` dict, or ``default`` if the document does not exist."""
+        if self._watch is None and self.version.changed():
+            self.cache.clear()
+
+        value = self.cache.get(name, _MISSING)
+        if value is _MISSING:
+            doc = self._ref(name).get()
+            value = doc.to_dict() if doc.exists else None
+            self.cache.set(name, value)
+        return default if value is None else value
+
+    def set(self, name, data):
+        """Replace ``settings/{name}`` and invalidate every instance's copy."""
+        self._ref(name).set(data)
+        self.cache.set(name, dict(data))
+        self.version.bump()
+
+    def invalidate(self, name):
+        self.cache.pop(name)
+        self.version.bump()
+
+    def _on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                self.cache.set(change.document.id, None)
+            else:
+                self.cache.set(change.document.id, change.document.to_dict())
+
+    def listen(self):
+        """Keep the cache current from a snapshot listener on the settings collection."""
+        if self._watch is None:
+            try:
+                self._watch = self.repos.settings.collection().on_snapshot(self._on_snapshot)
+            except Exception as e:
+                print(f"Settings Listener Error: {e}")
+        return self._watch
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
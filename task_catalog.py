@@ -0,0 +1,61 @@
+import os
+
+from cache import TTLCache, VersionStamp
+
+TASK_CACHE_TTL = int(os.getenv("TASK_CACHE_TTL", 600))
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", 5000))
+TASK_CACHE_STALENESS = int(os.getenv("TASK_CACHE_STALENESS", 30))
+
+_MISSING = object()
+
+
+class TaskCatalog:
+    """Process-wide cache of ``tasks/{id}`` documents.
+
+    Lookups hit memory first and fetch only the missing ids with one
+    ``get_all`` call. Deleted tasks are cached as ``None``. Publishing a task
+    writes it through with ``put()``, which also bumps the ``tasks`` version
+    stamp so other instances drop their copies within TASK_CACHE_STALENESS
+    seconds.
+    """
+
+    def __init__(self, repos, ttl=TASK_CACHE_TTL, maxsize=TASK_CACHE_SIZE, staleness=TASK_CACHE_STALENESS):
+        self.repos = repos
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.version = VersionStamp(repos, 'tasks', staleness=staleness)
+
+    def get_many(self, task_ids):
+        """Return ``{task_id: task dict or None}`` for every id in ``task_ids``."""
+        if self.version.changed():
+            self.cache.clear()
+
+        found = {}
+        missing = []
+        for task_id in set(task_ids):
+            if not task_id or '/' in str(task_id):
+                found[task_id] = None
+                continue
+            value = self.cache.get(task_id, _MISSING)
+            if value is _MISSING:
+                missing.append(task_id)
+            else:
+                found[task_id] = value
+
+        if missing:
+            for snap in self.repos.tasks.get_many(missing):
+                value = snap.to_dict() if snap.exists else None
+                self.cache.set(snap.id, value)
+                found[snap.id] = value
+        return found
+
+    def get(self, task_id):
+        return self.get_many([task_id]).get(task_id)
+
+    def put(self, task_id, data):
+        """Write-through after publishing or editing a task."""
+        self.cache.set(task_id, dict(data))
+        self.version.bump()
+
+    def invalidate(self, task_id):
+        self.cache.pop(task_id)
+        self.version.bump()
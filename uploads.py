@@ -0,0 +1,137 @@
+import os
+import time
+import datetime
+import queue
+import shutil
+import tempfile
+import threading
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", 100))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", 3))
+UPLOAD_BACKOFF = float(os.getenv("UPLOAD_BACKOFF", 1))
+UPLOAD_INLINE_TIMEOUT = float(os.getenv("UPLOAD_INLINE_TIMEOUT", 5))
+UPLOAD_BACKGROUND = os.getenv("UPLOAD_BACKGROUND", "0") == "1"  # long-lived workers only
+UPLOAD_STALE_MINUTES = int(os.getenv("UPLOAD_STALE_MINUTES", 30))
+UPLOAD_STALE_BATCH = 400  # Firestore allows 500 writes per batch
+
+
+class UploadPipeline:
+    """Uploads task proof images, optionally off the request path.
+
+    ``submit()`` spools the incoming file to a temp file and hands it to
+    ``uploader(fileobj, timeout) -> url or None``, then patches the
+    submission document with the URL (or ``upload_status='failed'``). By
+    default this happens inline, as a single attempt capped at
+    UPLOAD_INLINE_TIMEOUT seconds: a serverless instance (Vercel) is frozen
+    once the response is sent, so queued work would be lost, and a slow
+    image host must not hold the request past the function timeout. With
+    UPLOAD_BACKGROUND=1 (a process that outlives requests) a worker pool
+    does it instead, retrying with backoff at the uploader's own timeout;
+    when its queue is full the upload runs inline, so a burst slows the
+    submitting user down rather than dropping their proof.
+    ``expire_stale_uploads`` cleans up after uploads that never finished
+    either way.
+    """
+
+    def __init__(self, uploader, workers=UPLOAD_WORKERS, queue_size=UPLOAD_QUEUE_SIZE,
+                 retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF, background=UPLOAD_BACKGROUND,
+                 inline_timeout=UPLOAD_INLINE_TIMEOUT):
+        self.uploader = uploader
+        self.background = background
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.inline_timeout = inline_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Threads are started on first use so importing the app stays cheap.
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'upload-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, doc_ref, image_file):
+        """Queue ``image_file`` (a werkzeug FileStorage) for upload into ``doc_ref``'s proof field."""
+        spool = tempfile.NamedTemporaryFile(prefix='proof-', delete=False)
+        with spool:
+            shutil.copyfileobj(image_file.stream, spool)
+        job = (doc_ref, spool.name)
+        if not self.background:
+            self._process_inline(job)
+            return
+
+        self._start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            print("Upload Queue Full: uploading inline")
+            self._process_inline(job)
+
+    def join(self):
+        """Block until every queued upload has finished (used by tests and shutdown)."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process_inline(self, job):
+        # On the request path: one short attempt, no backoff sleeps.
+        self._process(job, attempts=1, timeout=self.inline_timeout)
+
+    def _process(self, job, attempts=None, timeout=None):
+        doc_ref, path = job
+        attempts = attempts or self.retries
+        try:
+            url = None
+            for attempt in range(attempts):
+                with open(path, 'rb') as fh:
+                    url = self.uploader(fh, timeout)
+                if url:
+                    break
+                if attempt + 1 < attempts:
+                    time.sleep(self.backoff * (2 ** attempt))
+
+            if url:
+                doc_ref.update({'proof': url, 'upload_status': 'done'})
+            else:
+                doc_ref.update({'upload_status': 'failed'})
+        except Exception as e:
+            print(f"Upload Worker Error: {e}")
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def expire_stale_uploads(repos, now=None, stale_minutes=UPLOAD_STALE_MINUTES, max_docs=UPLOAD_STALE_BATCH):
+    """Mark submissions whose upload never finished as ``upload_status='failed'``.
+
+    An upload still ``pending`` after ``stale_minutes`` was lost with its
+    instance (the spooled file is gone too, so it cannot be retried); the
+    admin panel then shows it as failed instead of uploading forever.
+    Returns the number of submissions marked.
+    """
+    now = now or datetime.datetime.now()
+    cutoff = now - datetime.timedelta(minutes=stale_minutes)
+    docs = list(repos.submissions.where('upload_status', '==', 'pending')
+                .where(field_path='timestamp', op_string='<', value=cutoff)
+                .select(['timestamp']).limit(max_docs).stream())
+    if docs:
+        batch = repos.batch()
+        for doc in docs:
+            batch.update(doc.reference, {'upload_status': 'failed'})
+        batch.commit()
+    return len(docs)